@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 
+from .counting import EstimatedCountPaginator
 from .forms import AppUserChangeForm, AppUserCreationForm
 from .models import (
     AppUser,
@@ -29,12 +30,25 @@ admin.site.register(UserProfile)
 admin.site.register(Category)
 
 
-admin.site.register(Post)
-admin.site.register(PostVote)
-admin.site.register(PostComment)
-admin.site.register(Book)
-admin.site.register(Video)
-admin.site.register(Tutorial)
-admin.site.register(PodcastEpisode)
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
-admin.site.register(Collection)
+
+class PostAdmin(LargeTableAdmin):
+    actions = ["approve_posts"]
+
+    @admin.action(description="Approve selected posts")
+    def approve_posts(self, request, queryset):
+        queryset.approve()
+
+
+admin.site.register(Post, PostAdmin)
+admin.site.register(PostVote, LargeTableAdmin)
+admin.site.register(PostComment, LargeTableAdmin)
+admin.site.register(Book, PostAdmin)
+admin.site.register(Video, PostAdmin)
+admin.site.register(Tutorial, PostAdmin)
+admin.site.register(PodcastEpisode, PostAdmin)
+
+admin.site.register(Collection, LargeTableAdmin)
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class DSHuntConfig(AppConfig):
     name = 'dshunt'
+
+    def ready(self):
+        from . import signals  # noqa: F401
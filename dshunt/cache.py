@@ -0,0 +1,51 @@
+import time
+
+from django.core.cache import cache
+
+POST_CARD_VERSION = "post-card"
+POST_CARD_TIMEOUT = 60 * 60
+
+COUNT_VERSION = "count"
+
+
+def version_key(name):
+    return "dshunt:version:{}".format(name)
+
+
+def get_version(name):
+    """
+    Current stamp of a family of cached values, bumped whenever their data changes.
+
+    It seeds from the clock so an evicted stamp never reuses an old version.
+    """
+    key = version_key(name)
+    version = cache.get(key)
+    if version is None:
+        version = int(time.time() * 1000)
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def bump_version(name):
+    try:
+        cache.incr(version_key(name))
+    except ValueError:
+        get_version(name)
+
+
+def model_count_version(model):
+    """
+    Version stamp of the cached counts of `model`'s rows, for tables written
+    too often to bump COUNT_VERSION, which every count depends on.
+    """
+    return "{}:{}".format(COUNT_VERSION, model._meta.label_lower)
+
+
+def get_post_card_version():
+    """Version stamp of the data shown on post cards besides the post row itself."""
+    return get_version(POST_CARD_VERSION)
+
+
+def bump_post_card_version():
+    bump_version(POST_CARD_VERSION)
@@ -0,0 +1,10 @@
+from django.utils.functional import SimpleLazyObject
+
+from .cache import POST_CARD_TIMEOUT, get_post_card_version
+
+
+def post_cards(request):
+    return {
+        "post_card_version": SimpleLazyObject(get_post_card_version),
+        "post_card_timeout": POST_CARD_TIMEOUT,
+    }
@@ -0,0 +1,68 @@
+"""
+Row counts for pagination that avoid a COUNT(*) per request.
+
+Small results are counted exactly and cached until a Post or Collection
+changes, or for votes and comments a row of their own table; results the
+planner expects to exceed COUNT_ESTIMATE_THRESHOLD rows use its estimate
+instead, which is exact enough for page links.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+from .cache import COUNT_VERSION, get_version, model_count_version
+
+COUNT_CACHE_TIMEOUT = 60 * 60
+
+
+def estimate_count(queryset):
+    """The planner's row estimate for `queryset`, None when it has none."""
+    connection = connections[queryset.db]
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+            # reltuples is -1 (or 0 on older servers) until the table is analyzed
+            return row[0] if row and row[0] > 0 else None
+        sql, params = queryset.order_by().query.sql_with_params()
+        cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def cached_count(queryset):
+    sql, params = queryset.order_by().query.sql_with_params()
+    digest = hashlib.md5("{}:{}".format(sql, params).encode()).hexdigest()
+    key = "dshunt:count:{}:{}:{}".format(
+        get_version(COUNT_VERSION), get_version(model_count_version(queryset.model)), digest
+    )
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, COUNT_CACHE_TIMEOUT)
+    return count
+
+
+def fast_count(queryset):
+    estimate = estimate_count(queryset)
+    if estimate is not None and estimate >= settings.COUNT_ESTIMATE_THRESHOLD:
+        return estimate
+    return cached_count(queryset)
+
+
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        if hasattr(self.object_list, "query"):
+            return fast_count(self.object_list)
+        return len(self.object_list)
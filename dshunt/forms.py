@@ -1,8 +1,13 @@
 from django import forms
+from django.conf import settings
 from django.contrib.auth.forms import UserCreationForm, UserChangeForm
+from django.core.exceptions import ValidationError
+from django.forms.models import ModelChoiceIterator
+from django.urls import reverse
 
 from .models import AppUser, UserProfile, Post, Book, Video, Tutorial, PodcastEpisode, PostType
-from .models import (Podcast, Channel, PostComment, Collection)
+from .models import (Category, Podcast, Channel, PostComment, Collection)
+from .reference import reference_table
 
 
 class AppUserCreationForm(UserCreationForm):
@@ -33,16 +38,74 @@ class UserProfileUpdateForm(forms.ModelForm):
         ]
 
 
+class ReferenceChoiceIterator(ModelChoiceIterator):
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ('', self.field.empty_label)
+        for obj in reference_table(self.queryset.model).all():
+            yield self.choice(obj)
+
+    def __len__(self):
+        return len(reference_table(self.queryset.model).rows()) + (
+            self.field.empty_label is not None
+        )
+
+
+class ReferenceChoiceField(forms.ModelChoiceField):
+    """
+    ModelChoiceField over a whole reference table, listed and validated from
+    the in-process cache instead of the database. Its queryset only names the
+    model.
+    """
+
+    iterator = ReferenceChoiceIterator
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        table = reference_table(self.queryset.model)
+        try:
+            obj = table.get(table.model._meta.pk.to_python(value))
+        except ValidationError:
+            obj = None
+        if obj is None:
+            raise ValidationError(
+                self.error_messages['invalid_choice'],
+                code='invalid_choice',
+                params={'value': value},
+            )
+        return obj
+
+
+# Create forms pick their reference rows through the cache
+REFERENCE_FIELD_CLASSES = {
+    'category': ReferenceChoiceField,
+    'channel': ReferenceChoiceField,
+    'podcast': ReferenceChoiceField,
+}
+
+
 class PostTypeForm(forms.Form):
     post_type = forms.ChoiceField(choices=PostType.choices)
 
 
+class SearchForm(forms.Form):
+    q = forms.CharField(max_length=255, required=False, label="Search")
+    post_type = forms.ChoiceField(
+        choices=[("", "All types")] + PostType.choices, required=False
+    )
+    category = ReferenceChoiceField(
+        queryset=Category.objects.all(), required=False, empty_label="All categories"
+    )
+
+
 class BookCreateForm(forms.ModelForm):
     author = forms.CharField()
     link = forms.URLField()
 
     class Meta:
         model = Book
+        field_classes = REFERENCE_FIELD_CLASSES
         fields = (
             'category',
             'title',
@@ -54,11 +117,12 @@ class BookCreateForm(forms.ModelForm):
 
 
 class VideoCreateForm(forms.ModelForm):
-    channel = forms.ModelChoiceField(queryset=Channel.objects.all())
+    channel = ReferenceChoiceField(queryset=Channel.objects.all())
     link = forms.URLField()
 
     class Meta:
         model = Video
+        field_classes = REFERENCE_FIELD_CLASSES
         fields = (
             'category',
             'title',
@@ -75,6 +139,7 @@ class TutorialCreateForm(forms.ModelForm):
 
     class Meta:
         model = Tutorial
+        field_classes = REFERENCE_FIELD_CLASSES
         fields = (
             'category',
             'title',
@@ -87,11 +152,12 @@ class TutorialCreateForm(forms.ModelForm):
 
 
 class PodcastEpisodeCreateForm(forms.ModelForm):
-    podcast = forms.ModelChoiceField(queryset=Podcast.objects.all())
+    podcast = ReferenceChoiceField(queryset=Podcast.objects.all())
     link = forms.URLField()
 
     class Meta:
         model = PodcastEpisode
+        field_classes = REFERENCE_FIELD_CLASSES
         fields = (
             'category',
             'title',
@@ -112,7 +178,48 @@ class CommentForm(forms.ModelForm):
         )
 
 
+class AutocompleteSelect(forms.Select):
+    """
+    Select rendering only its selected option, the others are fetched as
+    the user types from the JSON endpoint at `url_name`, see autocomplete.js.
+    """
+
+    def __init__(self, url_name, attrs=None):
+        super().__init__(attrs)
+        self.url_name = url_name
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        context['widget']['attrs']['data-autocomplete-url'] = reverse(self.url_name)
+        return context
+
+    def optgroups(self, name, value, attrs=None):
+        field = self.choices.field
+        selected = [v for v in value if str(v).isdigit()]
+        options = []
+        if field.empty_label is not None:
+            options.append(
+                self.create_option(name, '', field.empty_label, not selected, 0, attrs=attrs)
+            )
+        for obj in self.choices.queryset.filter(pk__in=selected):
+            options.append(
+                self.create_option(
+                    name, field.prepare_value(obj), field.label_from_instance(obj), True,
+                    len(options), attrs=attrs,
+                )
+            )
+        return [(None, [option], option['index']) for option in options]
+
+
+class AutocompleteSelectMultiple(AutocompleteSelect, forms.SelectMultiple):
+    """AutocompleteSelect keeping several choices, the selected ones rendered."""
+
+
 class CollectionForm(forms.ModelForm):
+    posts = forms.ModelMultipleChoiceField(
+        queryset=Post.objects.filter(approved=True),
+        widget=AutocompleteSelectMultiple('post-autocomplete'),
+    )
 
     class Meta:
         model = Collection
@@ -133,8 +240,39 @@ class CollectionForm(forms.ModelForm):
 
 
 class AddtoCollectionForm(forms.Form):
-    post = forms.ModelChoiceField(queryset=Post.objects.filter(approved=True))
+    post = forms.ModelChoiceField(
+        queryset=Post.objects.filter(approved=True),
+        widget=AutocompleteSelect('post-autocomplete'),
+    )
 
 
 class CollectionListForm(forms.Form):
-    collection = forms.ModelChoiceField(queryset=Collection.objects.all())
+    collection = forms.ModelChoiceField(
+        queryset=Collection.objects.none(),
+        widget=AutocompleteSelect('collection-autocomplete'),
+    )
+
+    def __init__(self, *args, user=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if user is not None and user.is_authenticated:
+            self.fields['collection'].queryset = Collection.objects.filter(created_user=user)
+
+
+class CollectionPostsForm(forms.Form):
+    action = forms.ChoiceField(choices=(('add', 'Add'), ('remove', 'Remove'), ('move', 'Move')))
+    posts = forms.CharField(help_text='Post ids, separated by commas or spaces')
+    after = forms.IntegerField(
+        required=False, help_text='Moved posts go after this post, or to the top when empty'
+    )
+
+    def clean_posts(self):
+        values = self.cleaned_data.get('posts').replace(',', ' ').split()
+        if not all(value.isdigit() for value in values):
+            raise forms.ValidationError("Post ids must be numbers")
+        # In the order given: it is the order posts are added or moved in
+        post_ids = list(dict.fromkeys(int(value) for value in values))
+        if len(post_ids) > settings.COLLECTION_BULK_MAX_POSTS:
+            raise forms.ValidationError(
+                "At most {} posts at a time".format(settings.COLLECTION_BULK_MAX_POSTS)
+            )
+        return post_ids
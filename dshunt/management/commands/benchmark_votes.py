@@ -0,0 +1,62 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import F
+
+from dshunt.models import Post, PostVoteCounter
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure vote counter throughput with concurrent writers on one post, "
+        "either on the single Post.total_votes row or on sharded counters. "
+        "The increments are reverted afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("post_id", type=int)
+        parser.add_argument("--mode", choices=["column", "sharded"], default="column")
+        parser.add_argument("--writers", type=int, default=16)
+        parser.add_argument("--votes", type=int, default=200, help="Votes per writer.")
+        parser.add_argument("--shards", type=int, default=16)
+
+    def handle(self, *args, **options):
+        post_id = options["post_id"]
+        Post.objects.get(pk=post_id)
+
+        if options["mode"] == "column":
+            def increment(delta):
+                Post.objects.filter(pk=post_id).update(total_votes=F("total_votes") + delta)
+        else:
+            def increment(delta):
+                PostVoteCounter.objects.add(post_id, delta, shards=options["shards"])
+
+        def writer():
+            try:
+                for _ in range(options["votes"]):
+                    increment(1)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=writer) for _ in range(options["writers"])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        total = options["writers"] * options["votes"]
+        increment(-total)
+        self.stdout.write(
+            "{mode}: {total} votes by {writers} writers in {elapsed:.2f}s "
+            "({rate:.0f} votes/s)".format(
+                mode=options["mode"],
+                total=total,
+                writers=options["writers"],
+                elapsed=elapsed,
+                rate=total / elapsed,
+            )
+        )
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from dshunt.vote_buffer import get_vote_buffer
+
+
+class Command(BaseCommand):
+    help = (
+        "Apply the buffered Post.total_votes increments and report the pending delta, "
+        "for buffers shared between processes such as CacheVoteBuffer."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--stats", action="store_true", help="Only report the buffer, do not flush it."
+        )
+
+    def handle(self, *args, **options):
+        vote_buffer = get_vote_buffer()
+        if vote_buffer is None:
+            raise CommandError("VOTE_BUFFER is not configured.")
+        if not vote_buffer.shared:
+            raise CommandError(
+                "{} lives in each web process, which flushes it and logs its stats to the "
+                "dshunt.vote_buffer logger.".format(type(vote_buffer).__name__)
+            )
+
+        if not options["stats"]:
+            deltas = vote_buffer.flush()
+            self.stdout.write(
+                self.style.SUCCESS(
+                    "Flushed {} votes over {} posts".format(sum(deltas.values()), len(deltas))
+                )
+            )
+        for name, value in vote_buffer.stats().items():
+            self.stdout.write("{}: {}".format(name, value))
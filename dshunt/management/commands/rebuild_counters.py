@@ -0,0 +1,83 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from dshunt.models import AppUser, Collection, Post, PostComment, PostVote, UserProfile
+
+CREATE_PROFILES_SQL = """
+    INSERT INTO {profile_table} (
+        user_id, headline, post_count, approved_post_count, vote_count, collection_count
+    )
+    SELECT u.id, 'Headline', 0, 0, 0, 0 FROM {user_table} u
+    WHERE NOT EXISTS (SELECT 1 FROM {profile_table} up WHERE up.user_id = u.id)
+"""
+
+POST_COUNTERS_SQL = """
+    UPDATE {post_table} p
+    SET comment_count = COALESCE(c.comments, 0), collection_count = COALESCE(m.collections, 0)
+    FROM {post_table} q
+    LEFT JOIN (
+        SELECT post_id, COUNT(*) AS comments FROM {comment_table} GROUP BY post_id
+    ) c ON c.post_id = q.id
+    LEFT JOIN (
+        SELECT post_id, COUNT(*) AS collections FROM {membership_table} GROUP BY post_id
+    ) m ON m.post_id = q.id
+    WHERE p.id = q.id AND (
+        p.comment_count <> COALESCE(c.comments, 0)
+        OR p.collection_count <> COALESCE(m.collections, 0)
+    )
+"""
+
+PROFILE_COUNTERS_SQL = """
+    UPDATE {profile_table} up
+    SET post_count = s.posts, approved_post_count = s.approved_posts,
+        vote_count = s.votes, collection_count = s.collections
+    FROM (
+        SELECT u.id AS user_id,
+               COALESCE(p.posts, 0) AS posts,
+               COALESCE(p.approved_posts, 0) AS approved_posts,
+               COALESCE(v.votes, 0) AS votes,
+               COALESCE(c.collections, 0) AS collections
+        FROM {user_table} u
+        LEFT JOIN (
+            SELECT created_user_id, COUNT(*) AS posts,
+                   COUNT(*) FILTER (WHERE approved) AS approved_posts
+            FROM {post_table} GROUP BY created_user_id
+        ) p ON p.created_user_id = u.id
+        LEFT JOIN (
+            SELECT created_user_id, COUNT(*) AS votes FROM {vote_table} GROUP BY created_user_id
+        ) v ON v.created_user_id = u.id
+        LEFT JOIN (
+            SELECT created_user_id, COUNT(*) AS collections
+            FROM {collection_table} GROUP BY created_user_id
+        ) c ON c.created_user_id = u.id
+    ) s
+    WHERE up.user_id = s.user_id AND (
+        up.post_count, up.approved_post_count, up.vote_count, up.collection_count
+    ) IS DISTINCT FROM (s.posts, s.approved_posts, s.votes, s.collections)
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the denormalized counters: Post.comment_count and collection_count, "
+        "and the post, approved post, vote and collection counts of user profiles."
+    )
+
+    def handle(self, *args, **options):
+        tables = {
+            "user_table": AppUser._meta.db_table,
+            "profile_table": UserProfile._meta.db_table,
+            "post_table": Post._meta.db_table,
+            "comment_table": PostComment._meta.db_table,
+            "vote_table": PostVote._meta.db_table,
+            "collection_table": Collection._meta.db_table,
+            "membership_table": Collection.posts.through._meta.db_table,
+        }
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(CREATE_PROFILES_SQL.format(**tables))
+            self.stdout.write("Created {} missing profiles".format(cursor.rowcount))
+            cursor.execute(POST_COUNTERS_SQL.format(**tables))
+            self.stdout.write("Corrected the counters of {} posts".format(cursor.rowcount))
+            cursor.execute(PROFILE_COUNTERS_SQL.format(**tables))
+            self.stdout.write("Corrected the counters of {} profiles".format(cursor.rowcount))
+        self.stdout.write(self.style.SUCCESS("Counters rebuilt"))
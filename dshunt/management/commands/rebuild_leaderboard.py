@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from dshunt.models import DailyRanking
+
+
+class Command(BaseCommand):
+    help = "Recompute the per-day post rankings used by the home and by-date feeds."
+
+    def handle(self, *args, **options):
+        rows = DailyRanking.objects.rebuild()
+        self.stdout.write(self.style.SUCCESS("Ranked {} posts".format(rows)))
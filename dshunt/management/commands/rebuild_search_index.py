@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from dshunt.search_index import get_search_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Rewrite the in-process search index file from the approved posts. Only used "
+        "on database backends without full-text search."
+    )
+
+    def handle(self, *args, **options):
+        posts = get_search_index().rebuild()
+        self.stdout.write(
+            self.style.SUCCESS("Indexed {} posts into {}".format(posts, settings.SEARCH_INDEX_PATH))
+        )
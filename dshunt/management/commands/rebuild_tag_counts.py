@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from dshunt.models import TagCount
+
+
+class Command(BaseCommand):
+    help = "Recount the approved posts of every tag behind the tag cloud."
+
+    def handle(self, *args, **options):
+        tags = TagCount.objects.rebuild()
+        self.stdout.write(self.style.SUCCESS("Counted {} tags".format(tags)))
@@ -0,0 +1,97 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from dshunt.models import DailyRanking, Post, PostVote
+from dshunt.page_cache import POSTS_TAG, expire_pages, post_tag
+
+DRIFT_SQL = """
+    SELECT p.id, p.total_votes, COALESCE(v.votes, 0)
+    FROM {post_table} p
+    LEFT JOIN (
+        SELECT post_id, COUNT(*) AS votes FROM {vote_table}
+        WHERE post_id >= %(start)s AND post_id < %(end)s
+        GROUP BY post_id
+    ) v ON v.post_id = p.id
+    WHERE p.id >= %(start)s AND p.id < %(end)s
+      AND p.total_votes <> COALESCE(v.votes, 0)
+    ORDER BY p.id
+"""
+
+# Taken before counting: a vote committing meanwhile holds its post's row
+# lock, so the count, in a later statement and snapshot, includes it
+LOCK_SQL = """
+    SELECT id FROM {post_table}
+    WHERE id >= %(start)s AND id < %(end)s
+    ORDER BY id
+    FOR UPDATE
+"""
+
+RECONCILE_SQL = """
+    UPDATE {post_table} p SET total_votes = v.votes
+    FROM (
+        SELECT t.id, COUNT(pv.id) AS votes
+        FROM {post_table} t
+        LEFT JOIN {vote_table} pv ON pv.post_id = t.id
+        WHERE t.id >= %(start)s AND t.id < %(end)s
+        GROUP BY t.id
+    ) v
+    WHERE p.id = v.id AND p.total_votes <> v.votes
+    RETURNING p.id
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute Post.total_votes from the PostVote rows, one id range at a time. "
+        "Run with --dry-run to only report the drifted posts. Flush the vote buffer "
+        "and roll up sharded counters first, or their pending votes count as drift."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true")
+        parser.add_argument(
+            "--chunk-size", type=int, default=50000, help="Post ids per statement."
+        )
+
+    def handle(self, *args, **options):
+        tables = {
+            "post_table": Post._meta.db_table,
+            "vote_table": PostVote._meta.db_table,
+        }
+        sql = (DRIFT_SQL if options["dry_run"] else RECONCILE_SQL).format(**tables)
+        lock_sql = LOCK_SQL.format(**tables)
+        chunk_size = options["chunk_size"]
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT MIN(id), MAX(id) FROM {post_table}".format(**tables))
+            min_id, max_id = cursor.fetchone()
+        if min_id is None:
+            self.stdout.write("No posts to reconcile")
+            return
+
+        drifted = 0
+        for start in range(min_id, max_id + 1, chunk_size):
+            params = {"start": start, "end": start + chunk_size}
+            # Each chunk commits on its own so row locks are held for one range only
+            with transaction.atomic(), connection.cursor() as cursor:
+                if not options["dry_run"]:
+                    cursor.execute(lock_sql, params)
+                cursor.execute(sql, params)
+                rows = cursor.fetchall()
+                if rows and not options["dry_run"]:
+                    expire_pages([POSTS_TAG] + [post_tag(row[0]) for row in rows])
+            drifted += len(rows)
+            if options["dry_run"]:
+                for post_id, total_votes, votes in rows:
+                    self.stdout.write(
+                        "post {}: total_votes={} votes={} drift={}".format(
+                            post_id, total_votes, votes, total_votes - votes
+                        )
+                    )
+
+        if options["dry_run"]:
+            self.stdout.write("{} posts have drifted".format(drifted))
+        else:
+            self.stdout.write(self.style.SUCCESS("Reconciled {} posts".format(drifted)))
+            if drifted:
+                DailyRanking.objects.rebuild()
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from dshunt.related import BLOCK_SIZE, RELATED_POSTS, changed_post_ids, refresh_related_posts
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the related posts shown on post pages. Only posts voted on or "
+        "edited since the last run are refreshed unless --full is given; run --full "
+        "periodically to pick up retracted votes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true", help="Refresh every approved post.")
+        parser.add_argument("--top", type=int, default=RELATED_POSTS, help="Neighbours per post.")
+        parser.add_argument(
+            "--block-size", type=int, default=BLOCK_SIZE, help="Posts per matrix product."
+        )
+
+    def handle(self, *args, **options):
+        post_ids = None if options["full"] else changed_post_ids()
+        if post_ids is not None and not post_ids:
+            self.stdout.write("No posts changed since the last run")
+            return
+        posts = refresh_related_posts(
+            post_ids, k=options["top"], block_size=options["block_size"]
+        )
+        self.stdout.write(self.style.SUCCESS("Refreshed related posts of {} posts".format(posts)))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from dshunt.models import Post
+
+
+class Command(BaseCommand):
+    help = "Recompute Post.trending_score from the recent votes. Run it on a schedule."
+
+    def handle(self, *args, **options):
+        posts = Post.objects.refresh_trending()
+        self.stdout.write(self.style.SUCCESS("Scored {} trending posts".format(posts)))
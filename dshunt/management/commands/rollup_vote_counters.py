@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from dshunt.models import DailyRanking, PostVoteCounter
+
+
+class Command(BaseCommand):
+    help = "Fold the sharded PostVoteCounter rows into Post.total_votes."
+
+    def handle(self, *args, **options):
+        days = PostVoteCounter.objects.rollup()
+        for day in days:
+            DailyRanking.objects.refresh_day(day)
+        self.stdout.write(
+            self.style.SUCCESS("Rolled up vote counters, re-ranked {} days".format(len(days)))
+        )
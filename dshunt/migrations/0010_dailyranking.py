@@ -0,0 +1,29 @@
+# Generated by Django 3.2.14 on 2026-10-18 16:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dshunt', '0009_auto_20240603_1741'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRanking',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('rank', models.PositiveIntegerField()),
+                ('total_votes', models.IntegerField(default=0)),
+                ('day_post_count', models.PositiveIntegerField(default=0)),
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='daily_ranking', to='dshunt.post')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='dailyranking',
+            index=models.Index(fields=['date', 'rank'], name='dshunt_dail_date_2046f3_idx'),
+        ),
+    ]
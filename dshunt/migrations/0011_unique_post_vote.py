@@ -0,0 +1,28 @@
+# Generated by Django 3.2.14 on 2026-10-18 16:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dshunt', '0010_dailyranking'),
+    ]
+
+    operations = [
+        # Drop duplicate votes left by the old get_or_create path before enforcing uniqueness
+        migrations.RunSQL(
+            """
+            DELETE FROM dshunt_postvote v
+            USING dshunt_postvote dup
+            WHERE v.post_id = dup.post_id
+              AND v.created_user_id = dup.created_user_id
+              AND v.id > dup.id
+            """,
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddConstraint(
+            model_name='postvote',
+            constraint=models.UniqueConstraint(fields=('post', 'created_user'), name='unique_post_vote'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.14 on 2026-10-18 16:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dshunt', '0011_unique_post_vote'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostVoteCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dshunt.post')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='postvotecounter',
+            constraint=models.UniqueConstraint(fields=('post', 'shard'), name='unique_post_vote_counter_shard'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.2.14 on 2026-10-18 16:18
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    # Indexes are built concurrently so the tables stay writable meanwhile
+    atomic = False
+
+    dependencies = [
+        ('dshunt', '0012_postvotecounter'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='collection',
+            index=models.Index(fields=['created_user', 'is_staffpick'], name='collection_user_staffpick_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='post',
+            index=models.Index(condition=models.Q(('approved', True)), fields=['-published_at', '-id'], name='post_approved_published_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='post',
+            index=models.Index(condition=models.Q(('approved', True)), fields=['post_type', '-total_votes', '-id'], name='post_approved_type_votes_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='postvote',
+            index=models.Index(fields=['created_user', 'post'], name='postvote_user_post_idx'),
+        ),
+        # The composite indexes above lead with created_user, so the FK indexes are redundant
+        migrations.AlterField(
+            model_name='collection',
+            name='created_user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='postvote',
+            name='created_user',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
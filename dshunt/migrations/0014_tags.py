@@ -0,0 +1,59 @@
+# Generated by Django 3.2.14 on 2026-10-18 16:22
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+# Same normalization as models.normalize_tags
+NORMALIZE_TAGS_SQL = """
+    UPDATE dshunt_post p SET tags = n.tags
+    FROM (
+        SELECT id, ARRAY(
+            SELECT tag FROM (
+                SELECT lower(regexp_replace(btrim(t), '\\s+', ' ', 'g')) AS tag, MIN(i) AS i
+                FROM unnest(tags) WITH ORDINALITY AS u (t, i)
+                WHERE btrim(t) <> ''
+                GROUP BY 1
+            ) s ORDER BY i
+        )::varchar(255)[] AS tags
+        FROM dshunt_post
+    ) n
+    WHERE p.id = n.id AND p.tags IS DISTINCT FROM n.tags
+"""
+
+COUNT_TAGS_SQL = """
+    INSERT INTO dshunt_tagcount (tag, post_count)
+    SELECT tag, COUNT(*) FROM dshunt_post p, unnest(p.tags) AS tag
+    WHERE p.approved
+    GROUP BY tag
+"""
+
+
+class Migration(migrations.Migration):
+    # The tag index is built concurrently so the post table stays writable meanwhile
+    atomic = False
+
+    dependencies = [
+        ('dshunt', '0013_hot_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(NORMALIZE_TAGS_SQL, migrations.RunSQL.noop),
+        migrations.CreateModel(
+            name='TagCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tag', models.CharField(max_length=255, unique=True)),
+                ('post_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='tagcount',
+            index=models.Index(fields=['-post_count', 'tag'], name='tagcount_cloud_idx'),
+        ),
+        migrations.RunSQL(COUNT_TAGS_SQL, migrations.RunSQL.noop),
+        AddIndexConcurrently(
+            model_name='post',
+            index=django.contrib.postgres.indexes.GinIndex(condition=models.Q(('approved', True)), fields=['tags'], name='post_approved_tags_idx'),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 3.2.14 on 2026-10-18 16:23
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+# Weighted document of a post, the configuration matches models.SEARCH_CONFIG
+DOCUMENT_FUNCTION_SQL = """
+    CREATE FUNCTION dshunt_post_document(title text, tags varchar[], author text, description text)
+    RETURNS tsvector AS $$
+        SELECT setweight(to_tsvector('english', coalesce(title, '')), 'A')
+            || setweight(to_tsvector('english', coalesce(array_to_string(tags, ' '), '')), 'B')
+            || setweight(to_tsvector('english', coalesce(author, '')), 'C')
+            || setweight(to_tsvector('english', coalesce(description, '')), 'D')
+    $$ LANGUAGE sql IMMUTABLE;
+
+    CREATE FUNCTION dshunt_post_search_vector() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'UPDATE'
+            AND OLD.search_vector IS NOT NULL
+            AND NEW.title IS NOT DISTINCT FROM OLD.title
+            AND NEW.tags IS NOT DISTINCT FROM OLD.tags
+            AND NEW.author IS NOT DISTINCT FROM OLD.author
+            AND NEW.description IS NOT DISTINCT FROM OLD.description
+        THEN
+            NEW.search_vector := OLD.search_vector;
+        ELSE
+            NEW.search_vector := dshunt_post_document(
+                NEW.title, NEW.tags, NEW.author, NEW.description
+            );
+        END IF;
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER dshunt_post_search_vector_update
+    BEFORE INSERT OR UPDATE ON dshunt_post
+    FOR EACH ROW EXECUTE PROCEDURE dshunt_post_search_vector();
+"""
+
+DROP_DOCUMENT_FUNCTION_SQL = """
+    DROP TRIGGER dshunt_post_search_vector_update ON dshunt_post;
+    DROP FUNCTION dshunt_post_search_vector();
+    DROP FUNCTION dshunt_post_document(text, varchar[], text, text);
+"""
+
+# Fired for every row, the trigger fills in the missing vectors
+BACKFILL_SQL = "UPDATE dshunt_post SET search_vector = NULL"
+
+
+class Migration(migrations.Migration):
+    # The search index is built concurrently so the post table stays writable meanwhile
+    atomic = False
+
+    dependencies = [
+        ('dshunt', '0014_tags'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(DOCUMENT_FUNCTION_SQL, DROP_DOCUMENT_FUNCTION_SQL),
+        migrations.RunSQL(BACKFILL_SQL, migrations.RunSQL.noop),
+        AddIndexConcurrently(
+            model_name='post',
+            index=django.contrib.postgres.indexes.GinIndex(condition=models.Q(('approved', True)), fields=['search_vector'], name='post_approved_search_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.14 on 2026-10-18 16:30
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Indexes are built concurrently so the tables stay writable meanwhile
+    atomic = False
+
+    dependencies = [
+        ('dshunt', '0016_relatedpost'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='trending_score',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        AddIndexConcurrently(
+            model_name='post',
+            index=models.Index(condition=models.Q(('approved', True)), fields=['-trending_score', '-id'], name='post_approved_trending_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='post',
+            index=models.Index(condition=models.Q(('approved', True)), fields=['post_type', '-trending_score', '-id'], name='post_approved_type_trend_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='postvote',
+            index=models.Index(fields=['created_at'], name='postvote_created_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.2.14 on 2026-10-18 16:36
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+import django.db.models.deletion
+
+COUNT_COMMENTS_SQL = """
+    UPDATE dshunt_post p SET comment_count = c.comments
+    FROM (
+        SELECT post_id, COUNT(*) AS comments FROM dshunt_postcomment GROUP BY post_id
+    ) c
+    WHERE p.id = c.post_id
+"""
+
+
+class Migration(migrations.Migration):
+    # The index is built concurrently so the comments table stays writable meanwhile
+    atomic = False
+
+    dependencies = [
+        ('dshunt', '0017_trending'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunSQL(COUNT_COMMENTS_SQL, migrations.RunSQL.noop),
+        AddIndexConcurrently(
+            model_name='postcomment',
+            index=models.Index(fields=['post', '-id'], name='postcomment_post_id_idx'),
+        ),
+        # The index above leads with post, so the FK index is redundant
+        migrations.AlterField(
+            model_name='postcomment',
+            name='post',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='dshunt.post'),
+        ),
+    ]
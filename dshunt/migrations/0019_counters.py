@@ -0,0 +1,85 @@
+# Generated by Django 3.2.14 on 2026-10-18 16:34
+
+from django.db import migrations, models
+
+# Same statements as `manage.py rebuild_counters`
+CREATE_PROFILES_SQL = """
+    INSERT INTO dshunt_userprofile (
+        user_id, headline, post_count, approved_post_count, vote_count, collection_count
+    )
+    SELECT u.id, 'Headline', 0, 0, 0, 0 FROM dshunt_appuser u
+    WHERE NOT EXISTS (SELECT 1 FROM dshunt_userprofile up WHERE up.user_id = u.id)
+"""
+
+COUNT_COLLECTIONS_SQL = """
+    UPDATE dshunt_post p SET collection_count = m.collections
+    FROM (
+        SELECT post_id, COUNT(*) AS collections FROM dshunt_collection_posts GROUP BY post_id
+    ) m
+    WHERE p.id = m.post_id
+"""
+
+PROFILE_COUNTERS_SQL = """
+    UPDATE dshunt_userprofile up
+    SET post_count = s.posts, approved_post_count = s.approved_posts,
+        vote_count = s.votes, collection_count = s.collections
+    FROM (
+        SELECT u.id AS user_id,
+               COALESCE(p.posts, 0) AS posts,
+               COALESCE(p.approved_posts, 0) AS approved_posts,
+               COALESCE(v.votes, 0) AS votes,
+               COALESCE(c.collections, 0) AS collections
+        FROM dshunt_appuser u
+        LEFT JOIN (
+            SELECT created_user_id, COUNT(*) AS posts,
+                   COUNT(*) FILTER (WHERE approved) AS approved_posts
+            FROM dshunt_post GROUP BY created_user_id
+        ) p ON p.created_user_id = u.id
+        LEFT JOIN (
+            SELECT created_user_id, COUNT(*) AS votes FROM dshunt_postvote GROUP BY created_user_id
+        ) v ON v.created_user_id = u.id
+        LEFT JOIN (
+            SELECT created_user_id, COUNT(*) AS collections
+            FROM dshunt_collection GROUP BY created_user_id
+        ) c ON c.created_user_id = u.id
+    ) s
+    WHERE up.user_id = s.user_id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dshunt', '0018_comment_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='collection_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='approved_post_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='collection_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='post_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='vote_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunSQL(CREATE_PROFILES_SQL, migrations.RunSQL.noop),
+        migrations.RunSQL(COUNT_COLLECTIONS_SQL, migrations.RunSQL.noop),
+        migrations.RunSQL(PROFILE_COUNTERS_SQL, migrations.RunSQL.noop),
+    ]
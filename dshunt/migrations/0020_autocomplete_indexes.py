@@ -0,0 +1,27 @@
+# Generated by Django 3.2.14 on 2026-10-18 16:39
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+import django.db.models.expressions
+import django.db.models.functions.comparison
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+    # Indexes are built concurrently so the tables stay writable meanwhile
+    atomic = False
+
+    dependencies = [
+        ('dshunt', '0019_counters'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='collection',
+            index=models.Index(django.db.models.expressions.F('created_user'), django.db.models.functions.comparison.Collate(django.db.models.functions.text.Upper('title'), 'C'), django.db.models.expressions.F('id'), name='collection_user_title_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='post',
+            index=models.Index(django.db.models.functions.comparison.Collate(django.db.models.functions.text.Upper('title'), 'C'), django.db.models.expressions.F('id'), condition=models.Q(('approved', True)), name='post_approved_title_idx'),
+        ),
+    ]
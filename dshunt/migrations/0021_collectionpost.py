@@ -0,0 +1,64 @@
+# Generated by Django 3.2.14 on 2026-10-18 16:41
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Existing memberships keep the order they were added in
+POSITIONS_SQL = """
+    UPDATE dshunt_collection_posts t SET position = 65536 * s.number
+    FROM (
+        SELECT id, row_number() OVER (PARTITION BY collection_id ORDER BY id) AS number
+        FROM dshunt_collection_posts
+    ) s
+    WHERE t.id = s.id
+"""
+
+
+class Migration(migrations.Migration):
+    # The index is built concurrently so the table stays writable meanwhile
+    atomic = False
+
+    dependencies = [
+        ('dshunt', '0020_autocomplete_indexes'),
+    ]
+
+    operations = [
+        # The through model takes over the table of the implicit one
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='CollectionPost',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('collection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dshunt.collection')),
+                        ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dshunt.post')),
+                    ],
+                    options={
+                        'db_table': 'dshunt_collection_posts',
+                        'unique_together': {('collection', 'post')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='collection',
+                    name='posts',
+                    field=models.ManyToManyField(through='dshunt.CollectionPost', to='dshunt.Post'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='collectionpost',
+            name='position',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunSQL(POSITIONS_SQL, migrations.RunSQL.noop),
+        AddIndexConcurrently(
+            model_name='collectionpost',
+            index=models.Index(fields=['collection', 'position', 'post'], name='collectionpost_position_idx'),
+        ),
+        migrations.AlterField(
+            model_name='collectionpost',
+            name='collection',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='dshunt.collection'),
+        ),
+    ]
@@ -1,17 +1,56 @@
+import datetime
+import random
+from itertools import chain
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AbstractUser
 from django.contrib.postgres.fields import ArrayField
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVectorField
+from django.db import connections, models, router, transaction
+from django.db.models.functions import Cast, Collate, TruncDate, Upper
+from django.db.models.query import ModelIterable
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from .cache import COUNT_VERSION, bump_version, model_count_version
+from .page_cache import POSTS_TAG, collection_tag, expire_pages, post_tag
+from .reference import reference_table
+
 # ---------------- User ---------------- #
 
 
+def exclude_derived_fields(instance, update_fields=None, force_insert=False):
+    """
+    The update_fields of a full save() of an existing `instance`, leaving out
+    its `derived_fields`. Those are maintained in the database with F()
+    updates, which writing back the loaded values would undo.
+    """
+    if update_fields is not None or force_insert or instance._state.adding:
+        return update_fields
+    return {
+        field.name
+        for field in instance._meta.concrete_fields
+        if not field.primary_key and field.name not in instance.derived_fields
+    }
+
+
 class AppUser(AbstractUser):
     pass
 
 
+class UserProfileManager(models.Manager):
+    def add_counts(self, user_id, **deltas):
+        """Add `deltas`, {counter: delta}, to the counters of `user_id`'s profile."""
+        deltas = {name: delta for name, delta in deltas.items() if delta}
+        if user_id is not None and deltas:
+            self.filter(user_id=user_id).update(
+                **{name: models.F(name) + delta for name, delta in deltas.items()}
+            )
+
+
 class UserProfile(models.Model):
     user = models.OneToOneField(AppUser, on_delete=models.CASCADE)
     headline = models.CharField(
@@ -23,10 +62,27 @@ class UserProfile(models.Model):
     github_profile = models.CharField(max_length=50, blank=True, null=True)
     linkedin = models.URLField(blank=True, null=True)
     youtube_channel = models.URLField(blank=True, null=True)
+    post_count = models.IntegerField(default=0, editable=False)
+    approved_post_count = models.IntegerField(default=0, editable=False)
+    vote_count = models.IntegerField(default=0, editable=False)
+    collection_count = models.IntegerField(default=0, editable=False)
+
+    objects = UserProfileManager()
+
+    # Counters kept by UserProfile.objects.add_counts(), never written by save()
+    derived_fields = ("post_count", "approved_post_count", "vote_count", "collection_count")
 
     def __str__(self):
         return str(self.headline)
 
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        super().save(
+            force_insert=force_insert,
+            force_update=force_update,
+            using=using,
+            update_fields=exclude_derived_fields(self, update_fields, force_insert),
+        )
+
     def get_absolute_url(self):
         return reverse('user-profile', kwargs={'pk': self.user.pk})
 
@@ -65,6 +121,25 @@ class Podcast(models.Model):
         return self.name
 
 
+# Case-folded title in byte order, so that a prefix is a range of an index on it
+TITLE_KEY = Collate(Upper("title"), "C")
+
+
+def title_prefix(queryset, text):
+    """
+    Rows of `queryset` whose title starts with `text`, ignoring case, in
+    title order. Backed by the indexes on TITLE_KEY.
+    """
+    start = text.upper()
+    queryset = queryset.annotate(title_key=TITLE_KEY).order_by("title_key", "id")
+    if not start:
+        return queryset
+    queryset = queryset.filter(title_key__gte=start)
+    if ord(start[-1]) < 0x10FFFF:
+        queryset = queryset.filter(title_key__lt=start[:-1] + chr(ord(start[-1]) + 1))
+    return queryset
+
+
 class PostType(models.TextChoices):
     BOOK = "book", _("Book")
     VIDEO = "video", _("Video")
@@ -72,6 +147,195 @@ class PostType(models.TextChoices):
     PODCAST = "podcast", _("Podcast")
 
 
+# Text search configuration, must match dshunt_post_document() in migration 0015
+SEARCH_CONFIG = "english"
+
+
+def normalize_tags(tags):
+    """Lower-cased, whitespace-collapsed tags without blanks or repeats, order kept."""
+    normalized = []
+    for tag in tags or ():
+        tag = " ".join(str(tag).split()).lower()
+        if tag and tag not in normalized:
+            normalized.append(tag)
+    return normalized
+
+
+class CardModelIterable(ModelIterable):
+    """Posts with their category, channel and podcast attached from the reference cache."""
+
+    relations = ("category", "channel", "podcast")
+
+    def __iter__(self):
+        model = self.queryset.model
+        fields = [model._meta.get_field(name) for name in self.relations]
+        tables = [reference_table(field.related_model).rows() for field in fields]
+        for obj in super().__iter__():
+            for field, rows in zip(fields, tables):
+                related = rows.get(getattr(obj, field.attname))
+                # A row created since the table was loaded is fetched on access
+                if related is not None:
+                    field.set_cached_value(obj, related)
+            yield obj
+
+
+class PostQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        """
+        Bulk update that stamps approved_at on newly approved posts, re-ranks
+        the leaderboard days touched by approval changes, recounts the tags
+        touched by approval or tag changes and expires the posts' cached pages
+        and counts.
+        """
+        from .search_index import get_search_index, search_index_enabled
+
+        if isinstance(kwargs.get("tags"), (list, tuple)):
+            kwargs["tags"] = normalize_tags(kwargs["tags"])
+        if "approved" not in kwargs and "tags" not in kwargs:
+            return super().update(**kwargs)
+
+        days = []
+        approval_changes = []
+        if "approved" in kwargs:
+            approval_changes = list(
+                self.exclude(approved=kwargs["approved"])
+                .order_by()
+                .values_list("created_user_id")
+                .annotate(posts=models.Count("id"))
+            )
+            if kwargs["approved"] and "approved_at" not in kwargs:
+                kwargs["approved_at"] = models.Case(
+                    models.When(approved=False, then=models.Value(timezone.now())),
+                    default=models.F("approved_at"),
+                )
+            days = list(
+                self.filter(published_at__isnull=False)
+                .annotate(day=TruncDate("published_at"))
+                .values_list("day", flat=True)
+                .distinct()
+            )
+        tags = set(chain.from_iterable(self.values_list("tags", flat=True)))
+        page_tags = [POSTS_TAG, *map(post_tag, self.values_list("pk", flat=True))]
+        search_post_ids = None
+        if search_index_enabled(self.db):
+            search_post_ids = list(self.values_list("pk", flat=True))
+        if isinstance(kwargs.get("tags"), list):
+            tags.update(kwargs["tags"])
+        with transaction.atomic(using=self.db):
+            rows = super().update(**kwargs)
+            for day in days:
+                DailyRanking.objects.db_manager(self.db).refresh_day_on_commit(day)
+            TagCount.objects.db_manager(self.db).refresh(tags)
+            sign = 1 if kwargs.get("approved") else -1
+            for user_id, posts in approval_changes:
+                UserProfile.objects.db_manager(self.db).add_counts(
+                    user_id, approved_post_count=sign * posts
+                )
+            if search_post_ids is not None:
+                transaction.on_commit(
+                    lambda: get_search_index().refresh(search_post_ids), using=self.db
+                )
+            expire_pages(page_tags, using=self.db)
+            transaction.on_commit(lambda: bump_version(COUNT_VERSION), using=self.db)
+        return rows
+
+    def approve(self):
+        return self.update(approved=True)
+
+    def sorted_by_newest(self):
+        return self.order_by("-published_at")
+
+    def sorted_by_upvotes(self):
+        return self.order_by("-total_votes")
+
+    def sorted_by_trending(self):
+        """By trending_score, as of the last `manage.py refresh_trending`."""
+        return self.order_by("-trending_score")
+
+    def refresh_trending(self, now=None):
+        """
+        Store every post's trending_score: its votes of the last
+        TRENDING_WINDOW_DAYS, each worth half as much every
+        TRENDING_HALF_LIFE_HOURS. Returns the number of scored posts.
+        """
+        now = now or timezone.now()
+        with transaction.atomic(using=self.db), connections[self.db].cursor() as cursor:
+            cursor.execute(
+                """
+                WITH scores AS (
+                    SELECT v.post_id, SUM(
+                        power(0.5, extract(epoch FROM %(now)s - v.created_at) / 3600.0
+                                   / %(half_life)s)
+                    ) AS score
+                    FROM {vote_table} v
+                    JOIN {table} p ON p.id = v.post_id AND p.approved
+                    WHERE v.created_at >= %(since)s
+                    GROUP BY v.post_id
+                ), expired AS (
+                    UPDATE {table} SET trending_score = 0
+                    WHERE approved AND trending_score > 0
+                      AND id NOT IN (SELECT post_id FROM scores)
+                )
+                UPDATE {table} p SET trending_score = scores.score
+                FROM scores
+                WHERE p.id = scores.post_id
+                """.format(table=self.model._meta.db_table, vote_table=PostVote._meta.db_table),
+                {
+                    "now": now,
+                    "since": now - datetime.timedelta(days=settings.TRENDING_WINDOW_DAYS),
+                    "half_life": settings.TRENDING_HALF_LIFE_HOURS,
+                },
+            )
+            return cursor.rowcount
+
+    def tagged(self, tags, match_all=True):
+        """Posts carrying every one of `tags`, or any of them unless `match_all`."""
+        tags = normalize_tags(tags)
+        if not tags:
+            return self
+        if match_all:
+            return self.filter(tags__contains=tags)
+        return self.filter(tags__overlap=tags)
+
+    def search(self, text):
+        """
+        Posts matching the web-search style query `text`, annotated with their
+        relevance as `rank`. Order by ("-rank", "-id") to keyset paginate them.
+
+        Backends without full-text search are answered from dshunt.search_index.
+        """
+        from .search_index import get_search_index, search_index_enabled
+
+        if search_index_enabled(self.db):
+            return get_search_index().filter_queryset(self, text)
+        query = SearchQuery(text, config=SEARCH_CONFIG, search_type="websearch")
+        return self.filter(search_vector=query).annotate(
+            # Double precision so the rank round-trips through pagination cursors
+            rank=Cast(SearchRank(models.F("search_vector"), query), models.FloatField())
+        )
+
+    def with_card_relations(self):
+        """
+        Load everything a post card shows with the posts: the user in the
+        same query, the reference rows from memory.
+        """
+        queryset = self.select_related("created_user")
+        queryset._iterable_class = CardModelIterable
+        return queryset
+
+    def with_user_votes(self, user):
+        """Annotate `is_voted` for `user` in the same query as the posts."""
+        if user is None or not user.is_authenticated:
+            return self.annotate(
+                is_voted=models.Value(False, output_field=models.BooleanField())
+            )
+        return self.annotate(
+            is_voted=models.Exists(
+                PostVote.objects.filter(post=models.OuterRef("pk"), created_user=user)
+            )
+        )
+
+
 class Post(models.Model):
     post_type = models.CharField(max_length=20, choices=PostType.choices)
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
@@ -89,109 +353,689 @@ class Post(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     total_votes = models.IntegerField(null=False, default=0, blank=False)
+    trending_score = models.FloatField(default=0, editable=False)
+    comment_count = models.IntegerField(default=0, editable=False)
+    collection_count = models.IntegerField(default=0, editable=False)
+    # Title, tags, author and description, kept current by a database trigger
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Latest posts and day archives
+            models.Index(
+                fields=["-published_at", "-id"],
+                condition=models.Q(approved=True),
+                name="post_approved_published_idx",
+            ),
+            # Per-type lists sorted by votes
+            models.Index(
+                fields=["post_type", "-total_votes", "-id"],
+                condition=models.Q(approved=True),
+                name="post_approved_type_votes_idx",
+            ),
+            # Trending lists, overall and per type
+            models.Index(
+                fields=["-trending_score", "-id"],
+                condition=models.Q(approved=True),
+                name="post_approved_trending_idx",
+            ),
+            models.Index(
+                fields=["post_type", "-trending_score", "-id"],
+                condition=models.Q(approved=True),
+                name="post_approved_type_trend_idx",
+            ),
+            # Tag pages and tag filters
+            GinIndex(
+                fields=["tags"],
+                condition=models.Q(approved=True),
+                name="post_approved_tags_idx",
+            ),
+            # Full-text search
+            GinIndex(
+                fields=["search_vector"],
+                condition=models.Q(approved=True),
+                name="post_approved_search_idx",
+            ),
+            # Title autocomplete, see title_prefix()
+            models.Index(
+                TITLE_KEY,
+                models.F("id"),
+                condition=models.Q(approved=True),
+                name="post_approved_title_idx",
+            ),
+        ]
+
+    # Fields whose loaded values save() compares against to detect transitions
+    tracked_fields = ("approved", "total_votes", "published_at", "tags")
+    # Maintained by the database, batch jobs and F() updates, never written by save()
+    derived_fields = ("search_vector", "trending_score", "comment_count", "collection_count")
 
     def __str__(self):
         return "{}-{}".format(self.title, self.approved)
 
     def get_vote_count(self):
+        if settings.VOTE_COUNTER_SHARDS:
+            return self.total_votes + PostVoteCounter.objects.pending_total(self.pk)
         return self.total_votes
 
     def is_voted(self, user):
         voted = self.postvote_set.filter(created_user=user).exists()
         return voted
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {
+            name: value
+            for name, value in zip(field_names, values)
+            if name in cls.tracked_fields
+        }
+        return instance
+
+    def get_loaded_values(self, using=None):
+        """Tracked field values as stored, read from the database only if never loaded."""
+        loaded = getattr(self, "_loaded_values", {})
+        missing = [name for name in self.tracked_fields if name not in loaded]
+        if missing:
+            stored = (
+                Post.objects.using(using or self._state.db)
+                .filter(pk=self.pk)
+                .values(*missing)
+                .first()
+            )
+            loaded = {**loaded, **(stored or {})}
+        return loaded
+
     def save(self, force_insert=False, force_update=False, using=None,
              update_fields=None):
-        from django.utils import timezone
-
-        if self.pk:
-            p = Post.objects.get(pk=self.pk)
-            if not p.approved and self.approved:
-                self.approved_at = timezone.now()
+        self.tags = normalize_tags(self.tags)
+        adding = self._state.adding
+        if adding:
+            self.published_at = self.published_at or timezone.now()
+            loaded = {}
         else:
-            self.published_at = timezone.now()
+            loaded = self.get_loaded_values(using)
+
+        update_fields = exclude_derived_fields(self, update_fields, force_insert)
+        saved_fields = self.tracked_fields
+        if update_fields is not None:
+            update_fields = set(update_fields)
+            saved_fields = [name for name in self.tracked_fields if name in update_fields]
+
+        if "approved" in saved_fields and self.approved and not loaded.get("approved"):
+            self.approved_at = timezone.now()
+            if update_fields is not None:
+                update_fields.add("approved_at")
+
+        changed = {name for name in saved_fields if loaded.get(name) != getattr(self, name)}
+        if self._state.adding:
+            rerank = self.approved
+        else:
+            rerank = "approved" in changed or (self.approved and bool(changed))
+
+        counted_tags = set(loaded.get("tags") or ()) if loaded.get("approved") else set()
+        approved = self.approved if "approved" in saved_fields else loaded.get("approved")
+        tags = self.tags if "tags" in saved_fields else loaded.get("tags")
+        tags = set(tags or ()) if approved else set()
+
+        using = using or router.db_for_write(self.__class__, instance=self)
+        with transaction.atomic(using=using):
+            result = super().save(
+                force_insert=force_insert,
+                force_update=force_update,
+                using=using,
+                update_fields=update_fields,
+            )
+            if tags != counted_tags:
+                TagCount.objects.db_manager(using).adjust(
+                    added=tags - counted_tags, removed=counted_tags - tags
+                )
+            UserProfile.objects.db_manager(using).add_counts(
+                self.created_user_id,
+                post_count=int(adding),
+                approved_post_count=int(bool(approved)) - int(bool(loaded.get("approved"))),
+            )
+
+        if rerank:
+            self.rerank(force=True)
+            previous_published_at = loaded.get("published_at")
+            if "published_at" in changed and previous_published_at:
+                DailyRanking.objects.refresh_day_on_commit(
+                    timezone.localdate(previous_published_at)
+                )
+        self._loaded_values = {
+            **loaded, **{name: getattr(self, name) for name in saved_fields}
+        }
+        return result
+
+    def rerank(self, force=False):
+        """Re-rank this post's day in the leaderboard once the transaction commits."""
+        if self.published_at and (self.approved or force):
+            DailyRanking.objects.refresh_day_on_commit(timezone.localdate(self.published_at))
+
+
+class PostVoteManager(models.Manager):
+    def cast(self, post, user):
+        """Record `user`'s vote on `post` once, returns whether a vote was added."""
+        # Stamped like auto_now_add, from the application clock
+        now = timezone.now()
+        with transaction.atomic(using=self.db), connections[self.db].cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO {table} (post_id, created_user_id, created_at, updated_at)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (post_id, created_user_id) DO NOTHING
+                RETURNING id
+                """.format(table=self.model._meta.db_table),
+                [post.pk, user.pk, now, now],
+            )
+            created = cursor.fetchone() is not None
+            if created:
+                self._add_to_total(post, 1)
+                UserProfile.objects.db_manager(self.db).add_counts(user.pk, vote_count=1)
+                expire_pages([POSTS_TAG, post_tag(post.pk)], using=self.db)
+                self._expire_counts()
+        return created
+
+    def retract(self, post, user):
+        """Remove `user`'s vote on `post`, returns whether a vote was removed."""
+        with transaction.atomic(using=self.db):
+            deleted, _ = self.filter(post=post, created_user=user).delete()
+            if deleted:
+                self._add_to_total(post, -deleted)
+                self._expire_counts()
+        return bool(deleted)
+
+    def _expire_counts(self):
+        transaction.on_commit(
+            lambda: bump_version(model_count_version(self.model)), using=self.db
+        )
 
-        return super().save(force_insert=False, force_update=False, using=None, update_fields=None)
+    def _add_to_total(self, post, delta):
+        from .vote_buffer import get_vote_buffer
+
+        post.total_votes += delta
+        vote_buffer = get_vote_buffer()
+        if vote_buffer is not None:
+            transaction.on_commit(lambda: vote_buffer.add(post.pk, delta), using=self.db)
+            return
+        if settings.VOTE_COUNTER_SHARDS:
+            PostVoteCounter.objects.add(post.pk, delta)
+            return
+        Post.objects.filter(pk=post.pk).update(total_votes=models.F("total_votes") + delta)
+        DailyRanking.objects.db_manager(self.db).add_votes_on_commit(post.pk, delta)
 
 
 class PostVote(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE)
+    # Indexed by postvote_user_post_idx
     created_user = models.ForeignKey(
-        get_user_model(), on_delete=models.CASCADE, blank=True, null=True
+        get_user_model(), on_delete=models.CASCADE, blank=True, null=True, db_index=False
     )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = PostVoteManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["post", "created_user"], name="unique_post_vote"
+            )
+        ]
+        indexes = [
+            models.Index(fields=["created_user", "post"], name="postvote_user_post_idx"),
+            # Recent votes, for trending scores and related post refreshes
+            models.Index(fields=["created_at"], name="postvote_created_idx"),
+        ]
+
     def __str__(self):
         return self.post.title
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        with transaction.atomic(using=kwargs.get("using")):
+            super().save(*args, **kwargs)
+            if adding:
+                UserProfile.objects.db_manager(self._state.db).add_counts(
+                    self.created_user_id, vote_count=1
+                )
+
+
+class PostVoteCounterManager(models.Manager):
+    def add(self, post_id, delta, shards=None):
+        """Add `delta` to a random shard of `post_id`'s counter."""
+        shard = random.randrange(shards or settings.VOTE_COUNTER_SHARDS)
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO {table} (post_id, shard, count) VALUES (%s, %s, %s)
+                ON CONFLICT (post_id, shard) DO UPDATE SET count = {table}.count + EXCLUDED.count
+                """.format(table=self.model._meta.db_table),
+                [post_id, shard, delta],
+            )
+
+    def pending_total(self, post_id):
+        return self.filter(post_id=post_id).aggregate(
+            total=models.Sum("count")
+        )["total"] or 0
+
+    def rollup(self):
+        """
+        Move every shard's count into Post.total_votes in one statement and
+        expire the changed posts' cached pages.
+
+        Returns the days whose leaderboard needs re-ranking.
+        """
+        with transaction.atomic(using=self.db), connections[self.db].cursor() as cursor:
+            cursor.execute(
+                """
+                WITH drained AS (
+                    DELETE FROM {table} RETURNING post_id, count
+                ), sums AS (
+                    SELECT post_id, SUM(count) AS delta FROM drained GROUP BY post_id
+                )
+                UPDATE {post_table} p SET total_votes = p.total_votes + sums.delta
+                FROM sums
+                WHERE p.id = sums.post_id AND sums.delta <> 0
+                RETURNING p.id, p.approved, p.published_at
+                """.format(
+                    table=self.model._meta.db_table, post_table=Post._meta.db_table
+                )
+            )
+            rows = cursor.fetchall()
+            if rows:
+                expire_pages(
+                    [POSTS_TAG] + [post_tag(post_id) for post_id, _, _ in rows], using=self.db
+                )
+            return {
+                timezone.localdate(published_at)
+                for post_id, approved, published_at in rows
+                if approved and published_at
+            }
+
+
+class PostVoteCounter(models.Model):
+    """
+    Not yet rolled up vote deltas of a post, spread over VOTE_COUNTER_SHARDS rows
+    so concurrent voters do not queue on a single row lock.
+    """
 
-class PostComment(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE)
+    shard = models.PositiveSmallIntegerField()
+    count = models.IntegerField(default=0)
+
+    objects = PostVoteCounterManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["post", "shard"], name="unique_post_vote_counter_shard"
+            )
+        ]
+
+
+class PostCommentQuerySet(models.QuerySet):
+    def with_user_ownership(self, user):
+        """Annotate `is_commented`, whether `user` wrote the comment, in the same query."""
+        if user is None or not user.is_authenticated:
+            return self.annotate(
+                is_commented=models.Value(False, output_field=models.BooleanField())
+            )
+        return self.annotate(
+            is_commented=models.ExpressionWrapper(
+                models.Q(created_user_id=user.pk), output_field=models.BooleanField()
+            )
+        )
+
+
+class PostComment(models.Model):
+    # Indexed by postcomment_post_id_idx
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, db_index=False)
     content = models.TextField()
     created_user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = PostCommentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [models.Index(fields=["post", "-id"], name="postcomment_post_id_idx")]
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        with transaction.atomic(using=kwargs.get("using")):
+            super().save(*args, **kwargs)
+            if adding:
+                Post.objects.filter(pk=self.post_id).update(
+                    comment_count=models.F("comment_count") + 1
+                )
+                transaction.on_commit(
+                    lambda: bump_version(model_count_version(PostComment)),
+                    using=kwargs.get("using"),
+                )
+
     def get_absolute_url(self):
         from django.urls import reverse_lazy
 
-        return reverse_lazy("post-detail", kwargs={"pk": self.post.pk})
-
-    def is_commented(self, user):
-        return self.created_user.id == user.id
+        return reverse_lazy("post-detail", kwargs={"pk": self.post_id})
 
 
 class Collection(models.Model):
     title = models.CharField(max_length=100)
     description = models.TextField()
-    posts = models.ManyToManyField(Post)
+    posts = models.ManyToManyField(Post, through="CollectionPost")
     is_staffpick = models.BooleanField(default=False)
     is_public = models.BooleanField(default=False)
-    created_user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE)
+    # Indexed by collection_user_staffpick_idx
+    created_user = models.ForeignKey(
+        get_user_model(), on_delete=models.CASCADE, db_index=False
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["created_user", "is_staffpick"], name="collection_user_staffpick_idx"
+            ),
+            # Autocomplete of the user's collections, see title_prefix()
+            models.Index(
+                models.F("created_user"),
+                TITLE_KEY,
+                models.F("id"),
+                name="collection_user_title_idx",
+            ),
+        ]
+
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        with transaction.atomic(using=kwargs.get("using")):
+            super().save(*args, **kwargs)
+            if adding:
+                UserProfile.objects.db_manager(self._state.db).add_counts(
+                    self.created_user_id, collection_count=1
+                )
+
+    def add_posts(self, post_ids):
+        """
+        Append the approved posts among `post_ids`, in that order, skipping
+        those already in the collection. Returns the number of posts added.
+        """
+        return CollectionPost.objects.db_manager(self._state.db).append(self, post_ids)
+
+    def remove_posts(self, post_ids):
+        """Remove `post_ids` in one statement, returns the number of posts removed."""
+        return CollectionPost.objects.db_manager(self._state.db).remove(self, post_ids)
+
+    def move_posts(self, post_ids, after=None):
+        """
+        Move `post_ids`, in that order, right after the post `after`, or to
+        the top. Returns the number of posts moved.
+        """
+        return CollectionPost.objects.db_manager(self._state.db).move(self, post_ids, after)
+
+    def ordered_posts(self):
+        """Its posts in collection order, annotated with their `position`."""
+        return (
+            Post.objects.using(self._state.db)
+            .filter(collectionpost__collection=self)
+            .annotate(position=models.F("collectionpost__position"))
+            .order_by("position", "id")
+        )
+
+
+class CollectionPostManager(models.Manager):
+    # Room left between neighbouring positions, so that most moves only write
+    # the moved rows
+    position_gap = 1 << 16
+
+    def _sql(self, sql):
+        return sql.format(table=self.model._meta.db_table, post_table=Post._meta.db_table)
+
+    def _lock(self, collection):
+        # Membership changes read the collection's positions, one at a time
+        list(
+            Collection.objects.using(self.db)
+            .select_for_update()
+            .filter(pk=collection.pk)
+            .values_list("pk")
+        )
+
+    def _touch(self, collection, counted_post_ids=()):
+        """
+        Mark `collection` changed, and the pages showing the collection_count
+        of `counted_post_ids`.
+        """
+        Collection.objects.using(self.db).filter(pk=collection.pk).update(
+            updated_at=timezone.now()
+        )
+        transaction.on_commit(lambda: bump_version(COUNT_VERSION), using=self.db)
+        tags = [collection_tag(collection.pk)]
+        if counted_post_ids:
+            tags += [POSTS_TAG, *map(post_tag, counted_post_ids)]
+        expire_pages(tags, using=self.db)
+
+    def append(self, collection, post_ids):
+        """See Collection.add_posts()."""
+        # Writes the table directly, so no m2m_changed signal: the statement
+        # keeps Post.collection_count itself
+        post_ids = list(dict.fromkeys(int(post_id) for post_id in post_ids))
+        if not post_ids:
+            return 0
+        with transaction.atomic(using=self.db), connections[self.db].cursor() as cursor:
+            self._lock(collection)
+            cursor.execute(
+                self._sql(
+                    """
+                    WITH top AS (
+                        SELECT COALESCE(MAX(position), 0) AS position
+                        FROM {table} WHERE collection_id = %(collection)s
+                    ), added AS (
+                        INSERT INTO {table} (collection_id, post_id, position)
+                        SELECT %(collection)s, p.id, top.position + %(gap)s * v.number
+                        FROM unnest(%(post_ids)s::bigint[]) WITH ORDINALITY AS v (id, number)
+                        JOIN {post_table} p ON p.id = v.id AND p.approved
+                        CROSS JOIN top
+                        ON CONFLICT (collection_id, post_id) DO NOTHING
+                        RETURNING post_id
+                    )
+                    UPDATE {post_table} p SET collection_count = p.collection_count + 1
+                    FROM added WHERE p.id = added.post_id
+                    RETURNING p.id
+                    """
+                ),
+                {"collection": collection.pk, "post_ids": post_ids, "gap": self.position_gap},
+            )
+            added = [post_id for post_id, in cursor.fetchall()]
+            if added:
+                self._touch(collection, added)
+        return len(added)
+
+    def remove(self, collection, post_ids):
+        """See Collection.remove_posts()."""
+        post_ids = sorted(set(int(post_id) for post_id in post_ids))
+        if not post_ids:
+            return 0
+        with transaction.atomic(using=self.db), connections[self.db].cursor() as cursor:
+            self._lock(collection)
+            cursor.execute(
+                self._sql(
+                    """
+                    WITH removed AS (
+                        DELETE FROM {table} WHERE collection_id = %s AND post_id = ANY(%s)
+                        RETURNING post_id
+                    )
+                    UPDATE {post_table} p SET collection_count = p.collection_count - 1
+                    FROM removed WHERE p.id = removed.post_id
+                    RETURNING p.id
+                    """
+                ),
+                [collection.pk, post_ids],
+            )
+            removed = [post_id for post_id, in cursor.fetchall()]
+            if removed:
+                self._touch(collection, removed)
+        return len(removed)
+
+    def move(self, collection, post_ids, after=None):
+        """
+        See Collection.move_posts(). The moved posts take positions between
+        `after` and the post following it. When those are too close, the
+        next few posts are spread out with them, doubling how many until
+        there is room, so a move never rewrites more than its neighbourhood.
+        """
+        post_ids = list(dict.fromkeys(int(post_id) for post_id in post_ids))
+        with transaction.atomic(using=self.db):
+            self._lock(collection)
+            memberships = self.filter(collection=collection)
+            found = set(memberships.filter(post_id__in=post_ids).values_list("post_id", flat=True))
+            post_ids = [post_id for post_id in post_ids if post_id in found]
+            if not post_ids or after in found:
+                return 0
+
+            following = memberships.exclude(post_id__in=post_ids).order_by("position", "post_id")
+            low = None
+            if after is not None:
+                low = following.filter(post_id=after).values_list("position", flat=True).first()
+                if low is None:
+                    return 0
+                following = following.filter(
+                    models.Q(position__gt=low) | models.Q(position=low, post_id__gt=after)
+                )
+
+            neighbours = 0
+            while True:
+                rows = list(following.values_list("post_id", "position")[:neighbours + 1])
+                spread, bound = rows[:neighbours], rows[neighbours:]
+                count = len(post_ids) + len(spread)
+                high = bound[0][1] if bound else None
+                if low is None and high is None:
+                    start, end = 0, self.position_gap * (count + 1)
+                elif low is None:
+                    start, end = high - self.position_gap * (count + 1), high
+                elif high is None:
+                    start, end = low, low + self.position_gap * (count + 1)
+                else:
+                    start, end = low, high
+                if end - start > count:
+                    break
+                neighbours = max(neighbours * 2, len(post_ids))
+
+            moved = post_ids + [post_id for post_id, position in spread]
+            positions = [start + (end - start) * (i + 1) // (count + 1) for i in range(count)]
+            with connections[self.db].cursor() as cursor:
+                cursor.execute(
+                    self._sql(
+                        """
+                        UPDATE {table} t SET position = v.position
+                        FROM unnest(%s::bigint[], %s::bigint[]) AS v (post_id, position)
+                        WHERE t.collection_id = %s AND t.post_id = v.post_id
+                        """
+                    ),
+                    [moved, positions, collection.pk],
+                )
+            self._touch(collection)
+        return len(post_ids)
+
+    def place_added(self, collection_ids, post_ids):
+        """
+        Move the memberships of `post_ids` just added to `collection_ids`
+        through the related managers, which write position 0, to the end of
+        their collection.
+        """
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(
+                self._sql(
+                    """
+                    WITH added AS (
+                        SELECT id, collection_id,
+                               row_number() OVER (PARTITION BY collection_id ORDER BY id) AS number
+                        FROM {table}
+                        WHERE collection_id = ANY(%(collection_ids)s)
+                          AND post_id = ANY(%(post_ids)s)
+                    ), top AS (
+                        SELECT collection_id, MAX(position) AS position FROM {table}
+                        WHERE collection_id = ANY(%(collection_ids)s)
+                          AND NOT post_id = ANY(%(post_ids)s)
+                        GROUP BY collection_id
+                    )
+                    UPDATE {table} t
+                    SET position = COALESCE(top.position, 0) + %(gap)s * added.number
+                    FROM added LEFT JOIN top ON top.collection_id = added.collection_id
+                    WHERE t.id = added.id
+                    """
+                ),
+                {
+                    "collection_ids": sorted(collection_ids),
+                    "post_ids": sorted(post_ids),
+                    "gap": self.position_gap,
+                },
+            )
+
+
+class CollectionPost(models.Model):
+    """A post of a collection, ordered by `position`."""
+
+    # Indexed by the unique (collection, post) and collectionpost_position_idx
+    collection = models.ForeignKey(Collection, on_delete=models.CASCADE, db_index=False)
+    post = models.ForeignKey(Post, on_delete=models.CASCADE)
+    # Sparse, see CollectionPostManager.move()
+    position = models.BigIntegerField(default=0)
+
+    objects = CollectionPostManager()
+
+    class Meta:
+        db_table = "dshunt_collection_posts"
+        unique_together = [("collection", "post")]
+        indexes = [
+            models.Index(
+                fields=["collection", "position", "post"], name="collectionpost_position_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return "{} #{} {}".format(self.collection_id, self.position, self.post_id)
+
 
 # Proxy Models
 
 
-class PostQuerySet(models.QuerySet):
+class ApprovedPostQuerySet(PostQuerySet):
     def all(self):
         return self.filter(approved=True)
 
-    def sorted_by_upvotes(self):
-        return self.order_by("-total_votes")
-
 
 class PostManager(models.Manager):
     def get_queryset(self):
-        return PostQuerySet(self.model, using=self._db).all()
+        return ApprovedPostQuerySet(self.model, using=self._db).all()
 
 
 class BookManager(models.Manager):
     def get_queryset(self):
-        return PostQuerySet(self.model, using=self._db).filter(post_type=PostType.BOOK)
+        return ApprovedPostQuerySet(self.model, using=self._db).filter(post_type=PostType.BOOK)
 
 
 class VideoManager(models.Manager):
     def get_queryset(self):
-        return PostQuerySet(self.model, using=self._db).filter(post_type=PostType.VIDEO)
+        return ApprovedPostQuerySet(self.model, using=self._db).filter(post_type=PostType.VIDEO)
 
 
 class TutorialManager(models.Manager):
     def get_queryset(self):
-        return PostQuerySet(self.model, using=self._db).filter(
+        return ApprovedPostQuerySet(self.model, using=self._db).filter(
             post_type=PostType.TUTORIAL
         )
 
 
 class PodcastManager(models.Manager):
     def get_queryset(self):
-        return PostQuerySet(self.model, using=self._db).filter(post_type=PostType.PODCAST)
+        return ApprovedPostQuerySet(self.model, using=self._db).filter(post_type=PostType.PODCAST)
 
 
 class Book(Post):
@@ -226,3 +1070,319 @@ class PodcastEpisode(Post):
         return reverse("post-submit")
 
     objects = PodcastManager()
+
+
+# ------------- LEADERBOARD -------------- #
+
+
+def day_bounds(day):
+    """Aware [start, end) datetimes covering `day` in the current time zone."""
+    start = timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+    end = timezone.make_aware(
+        datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time.min)
+    )
+    return start, end
+
+
+class DailyRankingManager(models.Manager):
+    # pg_advisory_xact_lock namespace, serialises concurrent refreshes of one day
+    lock_namespace = 7301
+
+    def top_posts(self, first_day, last_day, user=None, per_day=5):
+        """
+        Top `per_day` posts of every day in [first_day, last_day], newest day first.
+
+        Each post carries `post_date`, `day_rank`, `day_post_count` and `is_voted`.
+        """
+        rankings = (
+            self.filter(date__range=(first_day, last_day), rank__lte=per_day)
+            .select_related("post")
+            .order_by("-date", "rank")
+        )
+        if user is None or not user.is_authenticated:
+            rankings = rankings.annotate(
+                is_voted=models.Value(False, output_field=models.BooleanField())
+            )
+        else:
+            rankings = rankings.annotate(
+                is_voted=models.Exists(
+                    PostVote.objects.filter(post=models.OuterRef("post_id"), created_user=user)
+                )
+            )
+
+        posts = []
+        for ranking in rankings:
+            post = ranking.post
+            post.post_date = ranking.date
+            post.day_rank = ranking.rank
+            post.day_post_count = ranking.day_post_count
+            post.is_voted = ranking.is_voted
+            posts.append(post)
+        return posts
+
+    def refresh_day_on_commit(self, day):
+        transaction.on_commit(lambda: self.refresh_day(day), using=self.db)
+
+    def add_votes_on_commit(self, post_id, delta):
+        transaction.on_commit(lambda: self.add_votes(post_id, delta), using=self.db)
+
+    def add_votes(self, post_id, delta):
+        """
+        Add `delta` votes to a ranked post, moving it past the posts of its
+        day it overtakes or falls behind, and only those. The day's lock is
+        held for these few rows rather than a whole refresh_day().
+        """
+        day = self.filter(post_id=post_id).values_list("date", flat=True).first()
+        if day is None or not delta:
+            return
+        table = self.model._meta.db_table
+        with transaction.atomic(using=self.db), connections[self.db].cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_advisory_xact_lock(%s, %s)",
+                [self.lock_namespace, day.toordinal()],
+            )
+            # Posts rank by (total_votes, post_id) descending: the ones
+            # passed have keys strictly between the post's old and new key
+            cursor.execute(
+                """
+                WITH target AS (
+                    SELECT total_votes + %(delta)s AS votes,
+                           LEAST(total_votes, total_votes + %(delta)s) AS low,
+                           GREATEST(total_votes, total_votes + %(delta)s) AS high
+                    FROM {table} WHERE post_id = %(post)s AND date = %(date)s
+                ), passed AS (
+                    UPDATE {table} r SET rank = r.rank + SIGN(%(delta)s)
+                    FROM target t
+                    WHERE r.date = %(date)s
+                      AND (r.total_votes, r.post_id) > (t.low, %(post)s)
+                      AND (r.total_votes, r.post_id) < (t.high, %(post)s)
+                    RETURNING r.post_id
+                )
+                UPDATE {table} r
+                SET total_votes = t.votes,
+                    rank = r.rank - SIGN(%(delta)s) * (SELECT COUNT(*) FROM passed)
+                FROM target t
+                WHERE r.post_id = %(post)s AND r.date = %(date)s
+                """.format(table=table),
+                {"post": post_id, "date": day, "delta": delta},
+            )
+
+    def refresh_day(self, day):
+        """Re-rank the approved posts published on `day`."""
+        start, end = day_bounds(day)
+        table = self.model._meta.db_table
+        post_table = Post._meta.db_table
+        with transaction.atomic(using=self.db), connections[self.db].cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_advisory_xact_lock(%s, %s)",
+                [self.lock_namespace, day.toordinal()],
+            )
+            cursor.execute(
+                """
+                DELETE FROM {table} WHERE date = %s OR post_id IN (
+                    SELECT id FROM {post_table}
+                    WHERE approved AND published_at >= %s AND published_at < %s
+                )
+                """.format(table=table, post_table=post_table),
+                [day, start, end],
+            )
+            cursor.execute(
+                """
+                INSERT INTO {table} (date, post_id, rank, total_votes, day_post_count)
+                SELECT %s, p.id,
+                       ROW_NUMBER() OVER (ORDER BY p.total_votes DESC, p.id DESC),
+                       p.total_votes,
+                       COUNT(*) OVER ()
+                FROM {post_table} p
+                WHERE p.approved AND p.published_at >= %s AND p.published_at < %s
+                """.format(table=table, post_table=post_table),
+                [day, start, end],
+            )
+
+    def rebuild(self):
+        """Recompute the rankings of every day from scratch, returns the row count."""
+        table = self.model._meta.db_table
+        with transaction.atomic(using=self.db), connections[self.db].cursor() as cursor:
+            cursor.execute("LOCK TABLE {} IN EXCLUSIVE MODE".format(table))
+            cursor.execute("DELETE FROM {}".format(table))
+            cursor.execute(
+                """
+                INSERT INTO {table} (date, post_id, rank, total_votes, day_post_count)
+                SELECT post_date, id,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY post_date ORDER BY total_votes DESC, id DESC
+                       ),
+                       total_votes,
+                       COUNT(*) OVER (PARTITION BY post_date)
+                FROM (
+                    SELECT id, total_votes, (published_at AT TIME ZONE %s)::date AS post_date
+                    FROM {post_table}
+                    WHERE approved AND published_at IS NOT NULL
+                ) p
+                """.format(table=table, post_table=Post._meta.db_table),
+                [timezone.get_current_timezone_name()],
+            )
+            return cursor.rowcount
+
+
+class DailyRanking(models.Model):
+    date = models.DateField()
+    post = models.OneToOneField(
+        Post, on_delete=models.CASCADE, related_name="daily_ranking"
+    )
+    rank = models.PositiveIntegerField()
+    total_votes = models.IntegerField(default=0)
+    day_post_count = models.PositiveIntegerField(default=0)
+
+    objects = DailyRankingManager()
+
+    class Meta:
+        indexes = [models.Index(fields=["date", "rank"])]
+
+    def __str__(self):
+        return "{} #{} {}".format(self.date, self.rank, self.post_id)
+
+
+# ------------- RELATED POSTS -------------- #
+
+
+class RelatedPostManager(models.Manager):
+    def for_post(self, post, limit=None):
+        """Approved posts related to `post`, most similar first, in one indexed lookup."""
+        rows = (
+            self.filter(post=post, related__approved=True)
+            .select_related("related")
+            .order_by("rank")
+        )
+        return [row.related for row in rows[:limit]]
+
+    def replace(self, neighbours):
+        """
+        Store `neighbours`, {post_id: [(related_id, score), ...]} best first,
+        in place of the stored neighbours of those posts.
+        """
+        with transaction.atomic(using=self.db):
+            self.filter(post_id__in=list(neighbours)).delete()
+            self.bulk_create(
+                [
+                    self.model(post_id=post_id, related_id=related_id, rank=rank, score=score)
+                    for post_id, related in neighbours.items()
+                    for rank, (related_id, score) in enumerate(related, start=1)
+                ],
+                batch_size=1000,
+            )
+
+
+class RelatedPost(models.Model):
+    """A post's nearest neighbour, written by `manage.py refresh_related_posts`."""
+
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="related_post_set")
+    related = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="+")
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+    computed_at = models.DateTimeField(auto_now=True)
+
+    objects = RelatedPostManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["post", "rank"], name="unique_related_post_rank")
+        ]
+
+    def __str__(self):
+        return "{} #{} {}".format(self.post_id, self.rank, self.related_id)
+
+
+# ------------- TAGS -------------- #
+
+
+class TagCountManager(models.Manager):
+    def cloud(self, limit=50):
+        """The `limit` most used tags, most used first."""
+        return self.filter(post_count__gt=0).order_by("-post_count", "tag")[:limit]
+
+    def adjust(self, added=(), removed=()):
+        """Count one more approved post for each of `added` and one fewer for `removed`."""
+        table = self.model._meta.db_table
+        # Sorted so concurrent adjustments lock shared tags in the same order
+        added, removed = sorted(added), sorted(removed)
+        with transaction.atomic(using=self.db), connections[self.db].cursor() as cursor:
+            if added:
+                cursor.execute(
+                    """
+                    INSERT INTO {table} (tag, post_count)
+                    SELECT tag, 1 FROM unnest(%s::varchar[]) AS tag
+                    ON CONFLICT (tag) DO UPDATE SET post_count = {table}.post_count + 1
+                    """.format(table=table),
+                    [added],
+                )
+            if removed:
+                cursor.execute(
+                    """
+                    UPDATE {table} SET post_count = GREATEST(post_count - 1, 0)
+                    WHERE tag = ANY(%s)
+                    """.format(table=table),
+                    [removed],
+                )
+                cursor.execute(
+                    "DELETE FROM {table} WHERE tag = ANY(%s) AND post_count = 0".format(
+                        table=table
+                    ),
+                    [removed],
+                )
+
+    def refresh(self, tags):
+        """Recount the approved posts carrying each of `tags`."""
+        tags = sorted(set(tags))
+        if not tags:
+            return
+        with transaction.atomic(using=self.db), connections[self.db].cursor() as cursor:
+            cursor.execute(
+                """
+                WITH counts AS (
+                    SELECT tag, COUNT(*) AS post_count
+                    FROM {post_table} p, unnest(p.tags) AS tag
+                    WHERE p.approved AND p.tags && %(tags)s::varchar[]
+                      AND tag = ANY(%(tags)s)
+                    GROUP BY tag
+                ), removed AS (
+                    DELETE FROM {table}
+                    WHERE tag = ANY(%(tags)s) AND tag NOT IN (SELECT tag FROM counts)
+                )
+                INSERT INTO {table} (tag, post_count)
+                SELECT tag, post_count FROM counts
+                ON CONFLICT (tag) DO UPDATE SET post_count = EXCLUDED.post_count
+                """.format(table=self.model._meta.db_table, post_table=Post._meta.db_table),
+                {"tags": tags},
+            )
+
+    def rebuild(self):
+        """Recount every tag from scratch, returns the number of tags."""
+        table = self.model._meta.db_table
+        with transaction.atomic(using=self.db), connections[self.db].cursor() as cursor:
+            cursor.execute("LOCK TABLE {} IN EXCLUSIVE MODE".format(table))
+            cursor.execute("DELETE FROM {}".format(table))
+            cursor.execute(
+                """
+                INSERT INTO {table} (tag, post_count)
+                SELECT tag, COUNT(*) FROM {post_table} p, unnest(p.tags) AS tag
+                WHERE p.approved
+                GROUP BY tag
+                """.format(table=table, post_table=Post._meta.db_table)
+            )
+            return cursor.rowcount
+
+
+class TagCount(models.Model):
+    """Number of approved posts carrying each tag, kept in step with Post writes."""
+
+    tag = models.CharField(max_length=255, unique=True)
+    post_count = models.PositiveIntegerField(default=0)
+
+    objects = TagCountManager()
+
+    class Meta:
+        indexes = [models.Index(fields=["-post_count", "tag"], name="tagcount_cloud_idx")]
+
+    def __str__(self):
+        return "{} ({})".format(self.tag, self.post_count)
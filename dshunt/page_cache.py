@@ -0,0 +1,255 @@
+"""
+Full-page cache of anonymous GET requests to the post lists and details.
+
+Pages are stored in the CACHES alias named by the PAGE_CACHE setting, so
+the backend is whichever Django cache that alias configures: local memory,
+files, or a shared Memcached or Redis server. Each page records the
+versions of the tags it was rendered under ("posts" for every list,
+"post:<id>" and "references" for a detail page). Expiring a tag bumps its version, which
+invalidates every page carrying it without finding those pages.
+
+A page older than TIMEOUT, or whose tags moved, is stale. For another
+STALE_TIMEOUT seconds one request re-renders it while the others keep
+getting the stale copy, so a popular page never has more than one
+render in flight.
+
+The same tag versions answer conditional GETs, from anyone: a version is
+the time of the tag's last expiry in milliseconds, so together they give
+both an ETag and a Last-Modified date, and a client whose copy is current
+gets a 304 before the view runs a query. Both validators also move every
+TIMEOUT seconds, for what changes without expiring a tag (the trending
+order, related posts).
+"""
+import hashlib
+import threading
+import time
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+POSTS_TAG = "posts"
+# Categories, channels and podcasts, whose names every post page shows
+REFERENCES_TAG = "references"
+
+
+def post_tag(post_id):
+    return "post:{}".format(post_id)
+
+
+def collection_tag(collection_id):
+    return "collection:{}".format(collection_id)
+
+
+def user_collections_tag(user_id):
+    return "collections:user:{}".format(user_id)
+
+
+class PageCache:
+    key_prefix = "dshunt:page"
+
+    def __init__(self, cache="default", timeout=60, stale_timeout=300, lock_timeout=30):
+        self.cache = caches[cache]
+        self.timeout = timeout
+        self.stale_timeout = stale_timeout
+        self.lock_timeout = lock_timeout
+
+    def tag_key(self, tag):
+        return "{}:tag:{}".format(self.key_prefix, tag)
+
+    def tag_versions(self, tags):
+        """{tag: version} of `tags`, in one round trip once they exist."""
+        keys = {self.tag_key(tag): tag for tag in tags}
+        versions = self.cache.get_many(keys)
+        for key in keys.keys() - versions.keys():
+            # Seeded from the clock so an evicted tag never reuses an old version
+            self.cache.add(key, int(time.time() * 1000), None)
+            versions[key] = self.cache.get(key)
+        return {keys[key]: version for key, version in versions.items()}
+
+    def expire(self, tags):
+        keys = [self.tag_key(tag) for tag in tags]
+        versions = self.cache.get_many(keys)
+        now = int(time.time() * 1000)
+        # The expiry time, unless two fall in the same millisecond: a
+        # version only ever moves forward
+        self.cache.set_many({key: max(now, versions.get(key, 0) + 1) for key in keys}, None)
+
+    def validators(self, request, tags):
+        """(ETag, Last-Modified timestamp) of `request`'s page, tagged with `tags`."""
+        versions = self.tag_versions(tags)
+        period = int(time.time() // self.timeout) * self.timeout
+        # Logged-in pages show the user's own votes and comments
+        user = request.user.pk if request.user.is_authenticated else None
+        digest = hashlib.md5(
+            repr((sorted(versions.items()), period, user)).encode()
+        ).hexdigest()
+        last_modified = max([version // 1000 for version in versions.values()] + [period])
+        return quote_etag(digest), last_modified
+
+    def page_key(self, request, params):
+        query = urlencode(
+            sorted((name, value) for name in params for value in request.GET.getlist(name))
+        )
+        digest = hashlib.md5("{}?{}".format(request.path, query).encode()).hexdigest()
+        return "{}:{}".format(self.key_prefix, digest)
+
+    def is_cacheable(self, request):
+        return request.method in ("GET", "HEAD") and not request.user.is_authenticated
+
+    @staticmethod
+    def is_storable(response):
+        cache_control = response.get("Cache-Control", "")
+        return (
+            response.status_code == 200
+            and not response.streaming
+            # A cookie, a CSRF token for one, is never shared between visitors
+            and not response.cookies
+            and "private" not in cache_control
+            and "no-store" not in cache_control
+        )
+
+    def serve(self, request, params, tags, render):
+        """The cached page of `request`, or `render()`'s response, stored."""
+        key = self.page_key(request, params)
+        lock_key = key + ":lock"
+        entry = self.cache.get(key)
+        versions = self.tag_versions(tags)
+        now = time.time()
+
+        locked = False
+        if entry is not None:
+            created, page_versions, response = entry
+            if page_versions == versions and now - created < self.timeout:
+                response["X-Page-Cache"] = "hit"
+                return response
+            locked = self.cache.add(lock_key, 1, self.lock_timeout)
+            if not locked and now - created < self.timeout + self.stale_timeout:
+                response["X-Page-Cache"] = "stale"
+                return response
+
+        try:
+            response = render()
+            if hasattr(response, "render") and not response.is_rendered:
+                response.render()
+            if self.is_storable(response):
+                # Under the versions read before rendering, so a change
+                # committed meanwhile still marks it stale
+                self.cache.set(
+                    key, (now, versions, response), self.timeout + self.stale_timeout
+                )
+        finally:
+            if locked:
+                self.cache.delete(lock_key)
+        response["X-Page-Cache"] = "miss"
+        return response
+
+
+_page_cache = None
+_page_cache_config = None
+_page_cache_lock = threading.Lock()
+
+
+def get_page_cache():
+    """The configured page cache, or None when pages are not cached."""
+    global _page_cache, _page_cache_config
+    config = getattr(settings, "PAGE_CACHE", None)
+    if not config:
+        return None
+    with _page_cache_lock:
+        if _page_cache is None or _page_cache_config != config:
+            _page_cache = PageCache(
+                cache=config.get("CACHE", "default"),
+                timeout=config.get("TIMEOUT", 60),
+                stale_timeout=config.get("STALE_TIMEOUT", 300),
+            )
+            _page_cache_config = config
+    return _page_cache
+
+
+def expire_pages(tags, using=None):
+    """Invalidate the pages tagged with any of `tags` once the transaction commits."""
+    page_cache = get_page_cache()
+    if page_cache is not None:
+        tags = list(tags)
+        transaction.on_commit(lambda: page_cache.expire(tags), using=using)
+
+
+def serve_conditionally(request, tags, render):
+    """`render()`'s response to `request`, or a 304 when the client's copy is current."""
+    page_cache = get_page_cache()
+    if page_cache is None or request.method not in ("GET", "HEAD"):
+        return render()
+    etag, last_modified = page_cache.validators(request, tags)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = render()
+    if response.status_code in (200, 304):
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(last_modified)
+        # Revalidated on every use rather than kept by heuristic freshness
+        patch_cache_control(response, no_cache=True)
+    return response
+
+
+def conditional_page(get_tags):
+    """
+    Decorate a view to answer conditional GETs from the versions of the
+    tags `get_tags(request, *args, **kwargs)` returns.
+    """
+
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            return serve_conditionally(
+                request,
+                get_tags(request, *args, **kwargs),
+                lambda: view_func(request, *args, **kwargs),
+            )
+
+        return wrapper
+
+    return decorator
+
+
+class AnonymousPageCacheMixin:
+    """Serve anonymous GET requests of a view from the page cache."""
+
+    # Query parameters that change the page, the others share its cache
+    # entry. None leaves the view uncached.
+    page_cache_params = ("cursor", "per_page")
+
+    def get_page_cache_tags(self):
+        return [POSTS_TAG]
+
+    def dispatch(self, request, *args, **kwargs):
+        page_cache = get_page_cache()
+        if (
+            page_cache is None
+            or self.page_cache_params is None
+            or not page_cache.is_cacheable(request)
+        ):
+            return super().dispatch(request, *args, **kwargs)
+        return page_cache.serve(
+            request,
+            self.page_cache_params,
+            self.get_page_cache_tags(),
+            lambda: super(AnonymousPageCacheMixin, self).dispatch(request, *args, **kwargs),
+        )
+
+
+class ConditionalGetMixin(AnonymousPageCacheMixin):
+    """Also answer conditional GETs, from anyone, before the page is looked up."""
+
+    def dispatch(self, request, *args, **kwargs):
+        if self.page_cache_params is None:
+            return super().dispatch(request, *args, **kwargs)
+        return serve_conditionally(
+            request,
+            self.get_page_cache_tags(),
+            lambda: super(ConditionalGetMixin, self).dispatch(request, *args, **kwargs),
+        )
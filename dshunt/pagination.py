@@ -0,0 +1,231 @@
+import base64
+import datetime
+import json
+
+from django.core.paginator import InvalidPage
+from django.db.models import F, Q
+from django.http import Http404
+from django.utils.http import urlencode
+
+MAX_PER_PAGE = 100
+
+
+class CursorPage:
+    """A page of a CursorPaginator, linked to its neighbours by opaque cursors."""
+
+    is_cursor_page = True
+
+    def __init__(self, object_list, next_cursor, previous_cursor, params, cursor_param):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.params = params
+        self.cursor_param = cursor_param
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def _query(self, cursor):
+        params = self.params.copy() if self.params is not None else {}
+        params[self.cursor_param] = cursor
+        params.pop("page", None)
+        return "?" + urlencode(params, doseq=hasattr(params, "getlist"))
+
+    @property
+    def next_query(self):
+        return self._query(self.next_cursor) if self.has_next() else ""
+
+    @property
+    def previous_query(self):
+        return self._query(self.previous_cursor) if self.has_previous() else ""
+
+
+class CursorPaginator:
+    """
+    Keyset paginator: each page continues from the ordering key of the last
+    row seen, so deep pages cost the same as the first and no COUNT(*) is run.
+
+    The ordering must be on concrete columns of the model or on annotations of
+    the queryset; the primary key is appended as a tie-breaker when missing.
+    NULL keys sort after every value in ascending order and before them in
+    descending order, as PostgreSQL sorts them by default.
+    """
+
+    def __init__(self, queryset, per_page, ordering=None, cursor_param="cursor"):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.cursor_param = cursor_param
+        ordering = list(ordering or queryset.query.order_by or ["-pk"])
+        if not any(name.lstrip("-") in ("pk", "id") for name in ordering):
+            ordering.append("-pk" if ordering[0].startswith("-") else "pk")
+        self.ordering = ordering
+
+    def _field(self, name):
+        opts = self.queryset.model._meta
+        if name == "pk":
+            return opts.pk
+        if name in self.queryset.query.annotations:
+            return self.queryset.query.annotations[name].output_field
+        return opts.get_field(name)
+
+    def _attname(self, name):
+        if name in self.queryset.query.annotations:
+            return name
+        return self._field(name).attname
+
+    def _key(self, obj):
+        return [getattr(obj, self._attname(name.lstrip("-"))) for name in self.ordering]
+
+    def encode_cursor(self, direction, obj):
+        data = json.dumps([direction, self._key(obj)], default=self._encode_value)
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+    @staticmethod
+    def _encode_value(value):
+        # Full precision, keyset comparisons must match the stored value exactly
+        if isinstance(value, (datetime.datetime, datetime.date)):
+            return value.isoformat()
+        raise TypeError("Cannot encode {!r} in a cursor".format(value))
+
+    def decode_cursor(self, cursor):
+        try:
+            data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            direction, values = json.loads(data)
+            if direction not in ("next", "previous") or len(values) != len(self.ordering):
+                raise ValueError
+            values = [
+                self._field(name.lstrip("-")).to_python(value)
+                for name, value in zip(self.ordering, values)
+            ]
+        except Exception:
+            raise InvalidPage("Invalid cursor")
+        return direction, values
+
+    @staticmethod
+    def _reverse(ordering):
+        return [name[1:] if name.startswith("-") else "-" + name for name in ordering]
+
+    @staticmethod
+    def _order_by(ordering):
+        return [
+            F(name[1:]).desc(nulls_first=True)
+            if name.startswith("-")
+            else F(name).asc(nulls_last=True)
+            for name in ordering
+        ]
+
+    @staticmethod
+    def _equal(name, value):
+        if value is None:
+            return Q(**{"{}__isnull".format(name): True})
+        return Q(**{name: value})
+
+    def _beyond(self, name, value):
+        """Rows strictly after `value` in the order of `name`, None when there are none."""
+        field = name.lstrip("-")
+        if name.startswith("-"):
+            if value is None:
+                return Q(**{"{}__isnull".format(field): False})
+            return Q(**{"{}__lt".format(field): value})
+        if value is None:
+            return None
+        step = Q(**{"{}__gt".format(field): value})
+        if getattr(self._field(field), "null", True):
+            step |= Q(**{"{}__isnull".format(field): True})
+        return step
+
+    def _after(self, ordering, values):
+        """Rows strictly after `values` in `ordering`."""
+        condition = Q()
+        for i, name in enumerate(ordering):
+            step = self._beyond(name, values[i])
+            if step is None:
+                continue
+            for prior, value in zip(ordering[:i], values[:i]):
+                step &= self._equal(prior.lstrip("-"), value)
+            condition |= step
+        return condition
+
+    def page(self, cursor=None, params=None):
+        direction, values = self.decode_cursor(cursor) if cursor else ("next", None)
+        ordering = self.ordering if direction == "next" else self._reverse(self.ordering)
+
+        queryset = self.queryset
+        if values is not None:
+            queryset = queryset.filter(self._after(ordering, values))
+        rows = list(queryset.order_by(*self._order_by(ordering))[: self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[: self.per_page]
+
+        if direction == "next":
+            has_next, has_previous = has_more, values is not None
+        else:
+            rows.reverse()
+            has_next, has_previous = True, has_more
+
+        next_cursor = previous_cursor = None
+        if rows and has_next:
+            next_cursor = self.encode_cursor("next", rows[-1])
+        if rows and has_previous:
+            previous_cursor = self.encode_cursor("previous", rows[0])
+        return CursorPage(rows, next_cursor, previous_cursor, params, self.cursor_param)
+
+
+def clean_per_page(value, default, maximum=MAX_PER_PAGE):
+    """A page size asked for in the query string, capped at `maximum`, else `default`."""
+    if value and value.isdigit():
+        return min(max(int(value), 1), maximum)
+    return default
+
+
+def paginate_by_cursor(
+    request,
+    queryset,
+    per_page,
+    ordering=None,
+    per_page_param="per_page",
+    max_per_page=MAX_PER_PAGE,
+):
+    """
+    Cursor page of `queryset` for function views, 404 on a forged cursor.
+
+    `per_page` is the default page size, overridden by a valid `per_page_param`
+    query parameter up to `max_per_page`; pass None to ignore the parameter.
+    """
+    if per_page_param:
+        per_page = clean_per_page(request.GET.get(per_page_param), per_page, max_per_page)
+    paginator = CursorPaginator(queryset, per_page, ordering=ordering)
+    try:
+        page = paginator.page(request.GET.get(paginator.cursor_param), request.GET)
+    except InvalidPage as e:
+        raise Http404(str(e))
+    return paginator, page
+
+
+class CursorPaginationMixin:
+    """Swap ListView's OFFSET pagination for keyset pagination."""
+
+    cursor_ordering = None
+    max_paginate_by = MAX_PER_PAGE
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator, page = paginate_by_cursor(
+            self.request,
+            queryset,
+            page_size,
+            ordering=self.cursor_ordering,
+            max_per_page=self.max_paginate_by,
+        )
+        return paginator, page, page.object_list, page.has_other_pages()
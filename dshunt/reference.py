@@ -0,0 +1,80 @@
+"""
+Per-process cache of the small reference tables: categories, channels and
+podcasts.
+
+Each table is held in memory whole, with the version stamp it was loaded
+at. Saving or deleting a row bumps the stamp (see signals.py), and every
+process reloads the table the next time it is used. The cached instances
+are shared between requests, so treat them as read-only.
+
+The stamp only reaches other processes through a shared default cache. So
+a table is also reloaded once it is REFERENCE_CACHE_MAX_AGE seconds old,
+and a primary key it does not hold is looked up in the database, which
+reloads the table when the row exists.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from .cache import bump_version, get_version
+
+
+class ReferenceTable:
+    def __init__(self, model):
+        self.model = model
+        self.version_name = "reference:{}".format(model._meta.label_lower)
+        self._lock = threading.Lock()
+        self._version = None
+        self._loaded_at = None
+        self._rows = {}
+
+    def is_current(self, version):
+        max_age = getattr(settings, "REFERENCE_CACHE_MAX_AGE", 60)
+        return version == self._version and time.monotonic() - self._loaded_at < max_age
+
+    def load(self, version):
+        self._rows = {obj.pk: obj for obj in self.model._default_manager.order_by("pk")}
+        self._version = version
+        self._loaded_at = time.monotonic()
+
+    def rows(self):
+        """{pk: instance} of the whole table, reloaded when its version moved or it aged."""
+        version = get_version(self.version_name)
+        if not self.is_current(version):
+            with self._lock:
+                if not self.is_current(version):
+                    self.load(version)
+        return self._rows
+
+    def get(self, pk):
+        obj = self.rows().get(pk)
+        if obj is None and self.model._default_manager.filter(pk=pk).exists():
+            # Added by another process, whose version bump did not reach this one
+            with self._lock:
+                self.load(get_version(self.version_name))
+            obj = self._rows.get(pk)
+        return obj
+
+    def all(self):
+        return list(self.rows().values())
+
+    def expire(self):
+        # Bumped again on commit: a process reloading in between would
+        # otherwise keep the old rows under the new version
+        bump_version(self.version_name)
+        transaction.on_commit(lambda: bump_version(self.version_name))
+
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def reference_table(model):
+    """The ReferenceTable of `model`, one per process."""
+    model = model._meta.concrete_model
+    with _tables_lock:
+        if model not in _tables:
+            _tables[model] = ReferenceTable(model)
+        return _tables[model]
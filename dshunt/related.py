@@ -0,0 +1,144 @@
+"""
+Offline "related posts" for the post detail page.
+
+Two approved posts are similar by the cosine of their idf-weighted tags and
+of their voters, plus a flat boost when they share a category. Every post's
+similarities are one row of F @ F.T, where F stacks the weighted tag and
+voter matrices side by side, so the rows are computed a block at a time as
+sparse matrix products. The category boost only applies to pairs the product
+already found, which keeps the rows sparse.
+"""
+import math
+
+import numpy as np
+from django.db.models import Max
+from scipy import sparse
+
+from .models import Post, PostVote, RelatedPost
+
+RELATED_POSTS = 5
+TAG_WEIGHT = 1.0
+VOTE_WEIGHT = 1.0
+CATEGORY_WEIGHT = 0.25
+BLOCK_SIZE = 2000
+
+
+def _normalize_rows(matrix):
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms) @ matrix
+
+
+class PostSimilarity:
+    """Feature matrices of every approved post, loaded once per run."""
+
+    def __init__(self):
+        posts = list(
+            Post.objects.filter(approved=True)
+            .order_by("pk")
+            .values_list("pk", "category_id", "tags")
+        )
+        self.post_ids = np.array([post_id for post_id, category_id, tags in posts], dtype=np.int64)
+        self.categories = np.array(
+            [category_id for post_id, category_id, tags in posts], dtype=np.int64
+        )
+        self.positions = {post_id: i for i, post_id in enumerate(self.post_ids.tolist())}
+
+        tag_columns = {}
+        rows, columns = [], []
+        for i, (post_id, category_id, tags) in enumerate(posts):
+            for tag in set(tags):
+                rows.append(i)
+                columns.append(tag_columns.setdefault(tag, len(tag_columns)))
+        tags = sparse.csr_matrix(
+            (np.ones(len(rows)), (rows, columns)), shape=(len(posts), len(tag_columns))
+        )
+        document_frequency = np.asarray(tags.sum(axis=0)).ravel()
+        idf = np.log((len(posts) + 1) / (document_frequency + 1)) + 1
+        tags = _normalize_rows(tags @ sparse.diags(idf))
+
+        votes = np.array(
+            PostVote.objects.filter(post__approved=True, created_user__isnull=False)
+            .values_list("post_id", "created_user_id"),
+            dtype=np.int64,
+        ).reshape(-1, 2)
+        vote_rows = np.array([self.positions[post_id] for post_id in votes[:, 0].tolist()])
+        users, vote_columns = np.unique(votes[:, 1], return_inverse=True)
+        votes = _normalize_rows(
+            sparse.csr_matrix(
+                (np.ones(len(vote_rows)), (vote_rows.astype(np.int64), vote_columns)),
+                shape=(len(posts), len(users)),
+            )
+        )
+
+        # F @ F.T == TAG_WEIGHT * tags @ tags.T + VOTE_WEIGHT * votes @ votes.T
+        self.features = sparse.hstack(
+            [math.sqrt(TAG_WEIGHT) * tags, math.sqrt(VOTE_WEIGHT) * votes], format="csr"
+        )
+        self.features_t = self.features.T.tocsr()
+
+    def neighbours(self, positions, k=RELATED_POSTS):
+        """{post_id: [(related_id, score), ...]} of the posts at `positions`, best first."""
+        positions = np.asarray(positions, dtype=np.int64)
+        scores = (self.features[positions] @ self.features_t).tocoo()
+        row_positions = positions[scores.row]
+        same_category = self.categories[row_positions] == self.categories[scores.col]
+        data = scores.data + CATEGORY_WEIGHT * same_category
+        data[scores.col == row_positions] = 0
+        scores = sparse.csr_matrix((data, (scores.row, scores.col)), shape=scores.shape)
+        scores.eliminate_zeros()
+
+        result = {}
+        for i, position in enumerate(positions.tolist()):
+            start, end = scores.indptr[i], scores.indptr[i + 1]
+            row_data, row_columns = scores.data[start:end], scores.indices[start:end]
+            if len(row_data) > k:
+                best = np.argpartition(-row_data, k)[:k]
+                row_data, row_columns = row_data[best], row_columns[best]
+            order = np.lexsort((-self.post_ids[row_columns], -row_data))
+            result[int(self.post_ids[position])] = [
+                (int(self.post_ids[column]), float(score))
+                for column, score in zip(row_columns[order], row_data[order])
+            ]
+        return result
+
+
+def changed_post_ids():
+    """
+    Posts to refresh since the last run: those voted on or edited since,
+    and the posts listing one of them as a neighbour. None when nothing was
+    computed yet.
+    """
+    since = RelatedPost.objects.aggregate(since=Max("computed_at"))["since"]
+    if since is None:
+        return None
+    changed = set(PostVote.objects.filter(created_at__gte=since).values_list("post_id", flat=True))
+    changed.update(Post.objects.filter(updated_at__gte=since).values_list("pk", flat=True))
+    changed.update(
+        RelatedPost.objects.filter(related_id__in=changed).values_list("post_id", flat=True)
+    )
+    return changed
+
+
+def refresh_related_posts(post_ids=None, k=RELATED_POSTS, block_size=BLOCK_SIZE):
+    """
+    Recompute the neighbours of `post_ids`, or of every approved post, and
+    return the number of posts refreshed.
+    """
+    similarity = PostSimilarity()
+    if post_ids is None:
+        RelatedPost.objects.filter(post__approved=False).delete()
+        positions = list(range(len(similarity.post_ids)))
+    else:
+        post_ids = set(post_ids)
+        positions = sorted(
+            similarity.positions[post_id] for post_id in post_ids if post_id in similarity.positions
+        )
+        gone = post_ids.difference(similarity.positions)
+        RelatedPost.objects.filter(post_id__in=gone).delete()
+
+    for start in range(0, len(positions), block_size):
+        RelatedPost.objects.replace(
+            similarity.neighbours(positions[start:start + block_size], k=k)
+        )
+    return len(positions)
@@ -0,0 +1,410 @@
+"""
+In-process BM25 search over approved posts, used in place of Postgres
+full-text search when the database backend has none.
+
+The index is a single file, memory-mapped read-only:
+
+    header      magic, version, document and term counts, total document length
+    documents   post ids (uint32, ascending) then document lengths (uint32)
+    dictionary  JSON {term: [offset, count]} locating each term's postings
+    postings    per term, document numbers delta-encoded (uint32) then
+                term frequencies (uint16), padded to 4 bytes
+
+Posts saved or deleted after the file was written go to an in-memory
+overlay that shadows their mapped documents. compact() folds the overlay
+into a new file once it holds SEARCH_INDEX_MAX_OVERLAY posts, and
+`manage.py rebuild_search_index` rewrites the file from the database.
+
+The overlay belongs to the process that saved the posts: other processes
+find those changes once it compacts them into the file. Compactions and
+rebuilds hold an exclusive lock on `<path>.lock` while they read, merge and
+write the file, so no process overwrites edits another one just folded in.
+
+The rest of the schema (ArrayField, ON CONFLICT upserts, advisory locks)
+only runs on PostgreSQL, so in practice search_index_enabled() is only true
+in tests exercising this module on another backend.
+"""
+import bisect
+import fcntl
+import heapq
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+from array import array
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from itertools import accumulate
+
+from django.conf import settings
+from django.db import connections, models
+
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"DSBM"
+VERSION = 1
+HEADER = struct.Struct("<4sHxxIIQQ")
+
+TOKEN_RE = re.compile(r"\w+")
+STOP_WORDS = frozenset(
+    "a an and are as at be by for from how in is it of on or that the this to what with".split()
+)
+# Term frequency multiplier of each indexed field
+FIELD_WEIGHTS = (("title", 3), ("tags", 2), ("author", 1), ("description", 1))
+MAX_TERM_FREQUENCY = 2 ** 16 - 1
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+
+def search_index_enabled(using="default"):
+    """Whether searches on `using` go through this index instead of the database."""
+    return connections[using].vendor != "postgresql"
+
+
+def tokenize(text):
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in STOP_WORDS]
+
+
+def document_terms(post):
+    """Weighted term frequencies of `post`'s searchable fields."""
+    terms = Counter()
+    for name, weight in FIELD_WEIGHTS:
+        value = getattr(post, name) or ""
+        if name == "tags":
+            value = " ".join(value)
+        for token in tokenize(value):
+            terms[token] += weight
+    return terms
+
+
+def _pad(data, fill=b"\0"):
+    return data + fill * (-len(data) % 4)
+
+
+def write_index(path, documents):
+    """
+    Write `documents`, an iterable of (post_id, terms) sorted by post id,
+    to `path`, replacing any previous file atomically.
+    """
+    post_ids, lengths = array("I"), array("I")
+    postings = defaultdict(list)
+    for number, (post_id, terms) in enumerate(documents):
+        post_ids.append(post_id)
+        lengths.append(sum(terms.values()))
+        for term, frequency in terms.items():
+            postings[term].append((number, min(frequency, MAX_TERM_FREQUENCY)))
+
+    dictionary, chunks, offset = {}, [], 0
+    for term in sorted(postings):
+        numbers, frequencies = zip(*postings[term])
+        deltas = array("I", (b - a for a, b in zip((0,) + numbers, numbers)))
+        chunk = deltas.tobytes() + _pad(array("H", frequencies).tobytes())
+        dictionary[term] = [offset, len(numbers)]
+        chunks.append(chunk)
+        offset += len(chunk)
+    dictionary_bytes = _pad(json.dumps(dictionary, separators=(",", ":")).encode(), b" ")
+
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "wb") as f:
+        f.write(
+            HEADER.pack(
+                MAGIC, VERSION, len(post_ids), len(dictionary), sum(lengths),
+                len(dictionary_bytes),
+            )
+        )
+        f.write(post_ids.tobytes())
+        f.write(lengths.tobytes())
+        f.write(dictionary_bytes)
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive lock on `path`.lock, shared by every process using `path`."""
+    with open(path + ".lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class MappedIndex:
+    """Read-only view of an index file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = os.stat(path).st_mtime_ns
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        magic, version, count, term_count, total_length, dictionary_size = HEADER.unpack_from(
+            view
+        )
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{} is not a version {} search index".format(path, VERSION))
+
+        start = HEADER.size
+        self.post_ids = view[start:start + 4 * count].cast("I")
+        start += 4 * count
+        self.lengths = view[start:start + 4 * count].cast("I")
+        start += 4 * count
+        self.dictionary = json.loads(bytes(view[start:start + dictionary_size]))
+        self._postings = view[start + dictionary_size:]
+        self.count = count
+        self.total_length = total_length
+
+    @classmethod
+    def empty(cls):
+        index = cls.__new__(cls)
+        index.path, index.mtime = None, None
+        index.post_ids = index.lengths = ()
+        index.dictionary = {}
+        index.count = index.total_length = 0
+        return index
+
+    def position(self, post_id):
+        """Document number of `post_id`, None when it is not in the file."""
+        i = bisect.bisect_left(self.post_ids, post_id)
+        if i < self.count and self.post_ids[i] == post_id:
+            return i
+        return None
+
+    def postings(self, term):
+        """(document number, term frequency) pairs of `term`."""
+        if term not in self.dictionary:
+            return iter(())
+        offset, count = self.dictionary[term]
+        numbers = accumulate(self._postings[offset:offset + 4 * count].cast("I"))
+        frequencies = self._postings[offset + 4 * count:offset + 6 * count].cast("H")
+        return zip(numbers, frequencies)
+
+    def documents(self, exclude=()):
+        """Every (post_id, terms) in the file not in `exclude`, by post id."""
+        terms = defaultdict(Counter)
+        for term in self.dictionary:
+            for number, frequency in self.postings(term):
+                terms[number][term] = frequency
+        for number, post_id in enumerate(self.post_ids):
+            if post_id not in exclude:
+                yield post_id, terms[number]
+
+    def close(self):
+        if self.path is not None:
+            self.post_ids.release()
+            self.lengths.release()
+            self._postings.release()
+            try:
+                self._mmap.close()
+            except BufferError:
+                # A postings iterator still holds a view, the mapping goes with it
+                pass
+
+
+class SearchIndex:
+    def __init__(self, path, max_overlay=1000):
+        self.path = str(path)
+        self.max_overlay = max_overlay
+        self._lock = threading.RLock()
+        # post_id -> terms of posts indexed since the file was written
+        self._overlay = {}
+        # post_id -> term frequency, per overlay term
+        self._overlay_postings = defaultdict(dict)
+        self._removed = set()
+        self._mapped = None
+        self._load()
+
+    def _load(self):
+        if sys.byteorder != "little":
+            raise RuntimeError("The search index file format is little-endian only")
+        if self._mapped is not None:
+            self._mapped.close()
+        try:
+            self._mapped = MappedIndex(self.path)
+        except FileNotFoundError:
+            logger.warning("No search index at %s, run `manage.py rebuild_search_index`", self.path)
+            self._mapped = MappedIndex.empty()
+        # Mapped documents superseded by the overlay or removed since
+        self._shadowed = {
+            post_id: self._mapped.lengths[position]
+            for post_id in (*self._overlay, *self._removed)
+            for position in [self._mapped.position(post_id)]
+            if position is not None
+        }
+
+    def _reload_if_changed(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self._mapped.mtime:
+            self._load()
+
+    def _shadow(self, post_id):
+        position = self._mapped.position(post_id)
+        if position is not None:
+            self._shadowed[post_id] = self._mapped.lengths[position]
+
+    def _discard_overlay(self, post_id):
+        for term in self._overlay.pop(post_id, ()):
+            self._overlay_postings[term].pop(post_id, None)
+            if not self._overlay_postings[term]:
+                del self._overlay_postings[term]
+
+    def update(self, post):
+        """Index `post`, replacing any earlier version of it."""
+        with self._lock:
+            self._discard_overlay(post.pk)
+            self._removed.discard(post.pk)
+            terms = document_terms(post)
+            self._overlay[post.pk] = terms
+            for term, frequency in terms.items():
+                self._overlay_postings[term][post.pk] = frequency
+            self._shadow(post.pk)
+            self._compact_if_full()
+
+    def remove(self, post_id):
+        with self._lock:
+            self._discard_overlay(post_id)
+            if self._mapped.position(post_id) is not None:
+                self._removed.add(post_id)
+                self._shadow(post_id)
+            self._compact_if_full()
+
+    def refresh(self, post_ids):
+        """Re-read `post_ids` from the database, dropping those no longer approved."""
+        posts = {
+            post.pk: post
+            for post in Post.objects.filter(pk__in=post_ids, approved=True).only(
+                *(name for name, weight in FIELD_WEIGHTS)
+            )
+        }
+        for post_id in post_ids:
+            if post_id in posts:
+                self.update(posts[post_id])
+            else:
+                self.remove(post_id)
+
+    def _compact_if_full(self):
+        if len(self._overlay) + len(self._removed) >= self.max_overlay:
+            self.compact()
+
+    def compact(self):
+        """Write the mapped documents and the overlay to a new file."""
+        with self._lock, file_lock(self.path):
+            # Another process may have compacted its own overlay in since
+            self._load()
+            documents = dict(self._mapped.documents(exclude=self._shadowed))
+            documents.update(self._overlay)
+            write_index(self.path, sorted(documents.items()))
+            self._overlay.clear()
+            self._overlay_postings.clear()
+            self._removed.clear()
+            self._load()
+
+    def rebuild(self):
+        """Index every approved post from scratch, returns the number of posts."""
+        posts = (
+            Post.objects.filter(approved=True)
+            .only(*(name for name, weight in FIELD_WEIGHTS))
+            .order_by("pk")
+        )
+        count = 0
+
+        def documents():
+            nonlocal count
+            for post in posts.iterator(chunk_size=2000):
+                count += 1
+                yield post.pk, document_terms(post)
+
+        with self._lock, file_lock(self.path):
+            write_index(self.path, documents())
+            self._overlay.clear()
+            self._overlay_postings.clear()
+            self._removed.clear()
+            self._load()
+        return count
+
+    def search(self, text, limit=None):
+        """The best `limit` [(post_id, score)] for `text`, best first."""
+        terms = set(tokenize(text))
+        with self._lock:
+            self._reload_if_changed()
+            mapped, shadowed = self._mapped, self._shadowed
+            count = mapped.count - len(shadowed) + len(self._overlay)
+            if not terms or not count:
+                return []
+            total_length = (
+                mapped.total_length
+                - sum(shadowed.values())
+                + sum(sum(terms.values()) for terms in self._overlay.values())
+            )
+            average_length = total_length / count or 1
+
+            scores = defaultdict(float)
+            for term in terms:
+                overlay = self._overlay_postings.get(term, {})
+                base_count = mapped.dictionary.get(term, (0, 0))[1]
+                # Shadowed documents still count here, the error is small between compactions
+                frequency = base_count + len(overlay)
+                idf = math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+
+                for number, tf in mapped.postings(term):
+                    post_id = mapped.post_ids[number]
+                    if post_id not in shadowed:
+                        length = mapped.lengths[number]
+                        scores[post_id] += self._score(idf, tf, length, average_length)
+                for post_id, tf in overlay.items():
+                    length = sum(self._overlay[post_id].values())
+                    scores[post_id] += self._score(idf, tf, length, average_length)
+
+        best = heapq.nlargest(
+            limit or len(scores), scores.items(), key=lambda item: (item[1], item[0])
+        )
+        return best
+
+    @staticmethod
+    def _score(idf, tf, length, average_length):
+        return idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / average_length))
+
+    def filter_queryset(self, queryset, text):
+        """
+        `queryset` narrowed to the best SEARCH_INDEX_MAX_RESULTS matches of
+        `text`, annotated with their score as `rank`.
+        """
+        results = self.search(text, limit=settings.SEARCH_INDEX_MAX_RESULTS)
+        if not results:
+            return queryset.none().annotate(
+                rank=models.Value(0.0, output_field=models.FloatField())
+            )
+        return queryset.filter(pk__in=[post_id for post_id, score in results]).annotate(
+            rank=models.Case(
+                *[models.When(pk=post_id, then=models.Value(score)) for post_id, score in results],
+                output_field=models.FloatField(),
+            )
+        )
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_search_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = SearchIndex(
+                settings.SEARCH_INDEX_PATH, max_overlay=settings.SEARCH_INDEX_MAX_OVERLAY
+            )
+    return _index
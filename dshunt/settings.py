@@ -83,6 +83,7 @@ TEMPLATES = [
                 "django.template.context_processors.request",
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
+                "dshunt.context_processors.post_cards",
             ],
         },
     },
@@ -114,6 +115,76 @@ if db_from_env:
     DATABASES.update({"default": db_from_env})
 
 
+# Buffer Post.total_votes increments and apply them in batches, see dshunt/vote_buffer.py
+# VOTE_BUFFER = {
+#     "BACKEND": "dshunt.vote_buffer.MemoryVoteBuffer",
+#     "MAX_PENDING": 500,
+#     "MAX_DELAY": 5,
+#     "STATS_INTERVAL": 60,
+# }
+VOTE_BUFFER = None
+
+# Shows the vote buffer's flushes and periodic stats
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {"dshunt.vote_buffer": {"handlers": ["console"], "level": "INFO"}},
+}
+
+# Spread vote counts over this many PostVoteCounter rows per post, rolled up into
+# Post.total_votes by `manage.py rollup_vote_counters`. 0 updates Post.total_votes directly.
+VOTE_COUNTER_SHARDS = 0
+
+# Paginated results the planner expects to be larger than this show its estimate
+# instead of running COUNT(*), see dshunt/counting.py
+COUNT_ESTIMATE_THRESHOLD = 10000
+
+# Post.trending_score counts the votes of the last TRENDING_WINDOW_DAYS, each halving in
+# weight every TRENDING_HALF_LIFE_HOURS. Refreshed by `manage.py refresh_trending`.
+TRENDING_WINDOW_DAYS = 7
+TRENDING_HALF_LIFE_HOURS = 24
+
+# In-process search index used instead of Postgres full-text search on other database
+# backends, see dshunt/search_index.py. Rebuild it with `manage.py rebuild_search_index`.
+SEARCH_INDEX_PATH = os.path.join(BASE_DIR, "search_index.bin")
+# Posts changed since the last rebuild kept in memory before the file is rewritten
+SEARCH_INDEX_MAX_OVERLAY = 1000
+# Matches handed to the database for filtering and pagination
+SEARCH_INDEX_MAX_RESULTS = 1000
+
+# Seconds categories, channels and podcasts are held in memory before being
+# reloaded, for changes made by processes that share no cache with this one
+REFERENCE_CACHE_MAX_AGE = 60
+
+# Most post ids accepted by one bulk add or remove on a collection
+COLLECTION_BULK_MAX_POSTS = 1000
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # Point at a FileBasedCache, Memcached or Redis to share pages between workers
+    "pages": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "dshunt-pages",
+        "OPTIONS": {"MAX_ENTRIES": 2000},
+    },
+}
+
+# Full-page cache of anonymous requests to post lists and details, see
+# dshunt/page_cache.py. None disables it.
+PAGE_CACHE = {
+    # CACHES alias holding the pages
+    "CACHE": "pages",
+    # Seconds before a page is re-rendered even though none of its tags expired
+    "TIMEOUT": 60,
+    # Seconds past that, or past an expiry, a stale page is served while one
+    # request re-renders it
+    "STALE_TIMEOUT": 300,
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
 
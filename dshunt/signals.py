@@ -0,0 +1,187 @@
+from collections import Counter
+
+from django.db import models, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .cache import COUNT_VERSION, bump_post_card_version, bump_version, model_count_version
+from .models import (
+    AppUser,
+    Category,
+    Channel,
+    Collection,
+    CollectionPost,
+    DailyRanking,
+    Podcast,
+    Post,
+    PostComment,
+    PostVote,
+    TagCount,
+    UserProfile,
+)
+from .page_cache import (
+    POSTS_TAG,
+    REFERENCES_TAG,
+    collection_tag,
+    expire_pages,
+    post_tag,
+    user_collections_tag,
+)
+from .reference import reference_table
+from .search_index import get_search_index, search_index_enabled
+
+
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Channel)
+@receiver([post_save, post_delete], sender=Podcast)
+def expire_post_cards(sender, **kwargs):
+    reference_table(sender).expire()
+    bump_post_card_version()
+    expire_pages([POSTS_TAG, REFERENCES_TAG], using=kwargs.get("using"))
+
+
+@receiver([post_save, post_delete], sender=Post)
+def expire_post_pages(sender, instance, using, **kwargs):
+    expire_pages([POSTS_TAG, post_tag(instance.pk)], using=using)
+
+
+@receiver([post_save, post_delete], sender=PostComment)
+@receiver(post_delete, sender=PostVote)
+def expire_commented_post_pages(sender, instance, using, **kwargs):
+    # Lists show the vote and comment counts, the detail page the comments
+    expire_pages([POSTS_TAG, post_tag(instance.post_id)], using=using)
+
+
+@receiver([post_save, post_delete], sender=Collection)
+def expire_collection_pages(sender, instance, using, **kwargs):
+    expire_pages(
+        [collection_tag(instance.pk), user_collections_tag(instance.created_user_id)],
+        using=using,
+    )
+
+
+@receiver(m2m_changed, sender=Collection.posts.through)
+def expire_collection_member_pages(sender, instance, action, reverse, pk_set, using, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        if reverse:
+            # Unknown once a post's collections are cleared: those pages
+            # wait for the next TIMEOUT period
+            collection_ids = pk_set or ()
+        else:
+            collection_ids = [instance.pk]
+        expire_pages([collection_tag(pk) for pk in collection_ids], using=using)
+
+
+@receiver([post_save, post_delete], sender=Post)
+@receiver([post_save, post_delete], sender=Collection)
+@receiver(m2m_changed, sender=Collection.posts.through)
+def expire_counts(sender, **kwargs):
+    bump_version(COUNT_VERSION)
+
+
+@receiver(post_delete, sender=PostComment)
+def uncount_comment(sender, instance, using, **kwargs):
+    # Runs inside the deletion's transaction
+    Post.objects.using(using).filter(pk=instance.post_id).update(
+        comment_count=models.F("comment_count") - 1
+    )
+    transaction.on_commit(lambda: bump_version(model_count_version(PostComment)), using=using)
+
+
+@receiver(post_save, sender=AppUser)
+def create_profile(sender, instance, created, raw=False, **kwargs):
+    # Every user has a profile for the counters to be kept on
+    if created and not raw:
+        UserProfile.objects.get_or_create(user=instance, defaults={"headline": "Headline"})
+
+
+@receiver(post_delete, sender=Post)
+def uncount_post(sender, instance, using, **kwargs):
+    UserProfile.objects.db_manager(using).add_counts(
+        instance.created_user_id, post_count=-1, approved_post_count=-int(instance.approved)
+    )
+
+
+@receiver(post_delete, sender=Post)
+def rerank_deleted_post(sender, instance, using, **kwargs):
+    # Its ranking went with it, leaving a gap in the ranks of its day
+    if instance.approved and instance.published_at:
+        DailyRanking.objects.db_manager(using).refresh_day_on_commit(
+            timezone.localdate(instance.published_at)
+        )
+
+
+@receiver(post_delete, sender=PostVote)
+def uncount_vote(sender, instance, using, **kwargs):
+    UserProfile.objects.db_manager(using).add_counts(instance.created_user_id, vote_count=-1)
+
+
+@receiver(pre_delete, sender=Collection)
+def uncount_collection(sender, instance, using, **kwargs):
+    # Its memberships are deleted with it, without m2m_changed
+    Post.objects.using(using).filter(collection=instance).update(
+        collection_count=models.F("collection_count") - 1
+    )
+    UserProfile.objects.db_manager(using).add_counts(instance.created_user_id, collection_count=-1)
+
+
+@receiver(m2m_changed, sender=Collection.posts.through)
+def count_collection_posts(sender, instance, action, reverse, pk_set, using, **kwargs):
+    """Keep Post.collection_count in step, inside the membership change's transaction."""
+    memberships = sender.objects.using(using)
+    if reverse:
+        memberships = memberships.filter(post_id=instance.pk)
+    else:
+        memberships = memberships.filter(collection_id=instance.pk)
+
+    if action in ("pre_remove", "pre_clear"):
+        # post_remove is sent with every requested pk, remember the ones removed
+        if pk_set is not None:
+            memberships = memberships.filter(
+                **{"collection_id__in" if reverse else "post_id__in": pk_set}
+            )
+        instance._removed_post_ids = list(memberships.values_list("post_id", flat=True))
+        return
+    if action == "post_add":
+        post_ids = [instance.pk] * len(pk_set) if reverse else pk_set
+        delta = 1
+    elif action in ("post_remove", "post_clear"):
+        post_ids = instance.__dict__.pop("_removed_post_ids", [])
+        delta = -1
+    else:
+        return
+
+    by_count = {}
+    for post_id, count in Counter(post_ids).items():
+        by_count.setdefault(count, []).append(post_id)
+    for count, ids in by_count.items():
+        Post.objects.using(using).filter(pk__in=ids).update(
+            collection_count=models.F("collection_count") + delta * count
+        )
+
+
+@receiver(m2m_changed, sender=Collection.posts.through)
+def position_collection_posts(sender, instance, action, reverse, pk_set, using, **kwargs):
+    if action == "post_add" and pk_set:
+        collection_ids, post_ids = (pk_set, [instance.pk]) if reverse else ([instance.pk], pk_set)
+        CollectionPost.objects.db_manager(using).place_added(collection_ids, post_ids)
+
+
+@receiver(post_delete, sender=Post)
+def uncount_tags(sender, instance, using, **kwargs):
+    if instance.approved and instance.tags:
+        TagCount.objects.db_manager(using).adjust(removed=instance.tags)
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, using, **kwargs):
+    if search_index_enabled(using):
+        transaction.on_commit(lambda: get_search_index().refresh([instance.pk]), using=using)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, using, **kwargs):
+    if search_index_enabled(using):
+        post_id = instance.pk
+        transaction.on_commit(lambda: get_search_index().remove(post_id), using=using)
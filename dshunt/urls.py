@@ -31,6 +31,9 @@ urlpatterns = [
         "podcast-episodes/", views.PodcastEpisodeListView.as_view(), name="podcast-list"
     ),
 
+    path("search/", views.PostSearchView.as_view(), name="search"),
+    path("posts/autocomplete/", views.post_autocomplete_view, name="post-autocomplete"),
+
     # Post Submit
     path("post/", views.PostSubmitPageView.as_view(), name="post-submit"),
     path("books/new/", views.BookCreateView.as_view(), name="book-create"),
@@ -52,14 +55,25 @@ urlpatterns = [
 
     # vote
     path("post/<int:id>/vote", views.Vote.as_view(), name="post-vote"),
+    path("post/<int:id>/unvote", views.Unvote.as_view(), name="post-unvote"),
 
     # Collection
     path('collections/', views.collection_list_view, name='collection-list'),
     path('collections/<int:pk>/', views.collection_detail_view, name='collection-detail'),
     path('collections/new/', views.collection_create_view, name='collection-create'),
     path('collections/<int:pk>/post/new/', views.add_post_to_collection_view, name='add-to-collection'),
+    path('collections/<int:pk>/posts/', views.collection_posts_view, name='collection-posts'),
+    path(
+        'collections/autocomplete/',
+        views.collection_autocomplete_view,
+        name='collection-autocomplete',
+    ),
     path('collections/staff-pick/', views.staff_pick_collection_list, name='staff-pick-collection'),
 
     # category
     path("category/", views.category, name="category"),
+
+    # tags
+    path("tags/", views.tag_list, name="tag-list"),
+    path("tags/<path:tag>/", views.TagPostListView.as_view(), name="tag-posts"),
 ]
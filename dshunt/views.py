@@ -1,15 +1,17 @@
 import datetime
+from itertools import groupby
+from operator import attrgetter
 
 from django.contrib.auth.decorators import login_required
-from django.db import transaction
 from django.shortcuts import get_object_or_404, redirect, render
-from django.http import HttpResponseNotFound
+from django.http import HttpResponseNotFound, JsonResponse
 from django.urls import reverse_lazy
+from django.utils import timezone
 from django.utils.decorators import method_decorator
 from django.views import View
+from django.views.decorators.http import require_POST
 from django.views.generic import CreateView, DetailView, ListView, UpdateView
 from django.views.generic.dates import DayArchiveView
-from django.core.paginator import Paginator
 
 from .forms import (
     UserProfileUpdateForm,
@@ -21,21 +23,40 @@ from .forms import (
     VideoCreateForm,
     CollectionForm,
     CollectionListForm,
+    CollectionPostsForm,
     AddtoCollectionForm,
+    SearchForm,
 )
 from .models import (
     UserProfile,
     Book,
     Category,
+    DailyRanking,
     PodcastEpisode,
     Post,
+    PostComment,
     PostType,
     PostVote,
+    RelatedPost,
+    TagCount,
     Tutorial,
     Video,
     Collection,
     AppUser,
+    title_prefix,
 )
+from .counting import EstimatedCountPaginator, fast_count
+from .page_cache import (
+    POSTS_TAG,
+    REFERENCES_TAG,
+    ConditionalGetMixin,
+    collection_tag,
+    conditional_page,
+    post_tag,
+    user_collections_tag,
+)
+from .pagination import CursorPaginationMixin, paginate_by_cursor
+from .reference import reference_table
 from django.contrib.auth.mixins import LoginRequiredMixin
 
 
@@ -50,12 +71,8 @@ class UserProfileDetailsView(LoginRequiredMixin, View):
         )
         context = dict()
         context["object"] = user_obj
-        context["post_count"] = Post.objects.filter(
-            approved=True, created_user=user
-        ).count()
-        context["collection_count"] = Collection.objects.filter(
-            created_user=user
-        ).count()
+        context["post_count"] = user_obj.approved_post_count
+        context["collection_count"] = user_obj.collection_count
         return render(self.request, "dshunt/user/user_profile_detail.html", context)
 
 
@@ -66,56 +83,65 @@ class UserProfileUpdateView(UpdateView):
     template_name = "dshunt/user/user_update_form.html"
 
 
-class UserSubmittedListView(ListView):
+class UserSubmittedListView(CursorPaginationMixin, ListView):
     paginate_by = 10
-    page_kwarg = "page"
+    cursor_ordering = ["-id"]
     template_name = "dshunt/user/user_post_list.html"
 
     def get_queryset(self):
-        return Post.objects.filter(created_user_id=self.kwargs["pk"])
+        return Post.objects.filter(created_user_id=self.kwargs["pk"]).with_user_votes(
+            self.request.user
+        )
 
     def get_context_data(self, *args, **kwargs):
         context = super().get_context_data(*args, **kwargs)
-        context["add_to_coll_form"] = CollectionListForm()
+        context["add_to_coll_form"] = CollectionListForm(user=self.request.user)
         return context
 
 
 class UserUpvotedPostListView(UserSubmittedListView):
     def get_queryset(self):
-        return Post.objects.filter(postvote__created_user_id=self.kwargs["pk"])
+        return Post.objects.filter(
+            postvote__created_user_id=self.kwargs["pk"]
+        ).with_user_votes(self.request.user)
 
 
 class UserApprovedPostListView(UserSubmittedListView):
     def get_queryset(self):
-        return Post.objects.filter(created_user_id=self.kwargs["pk"], approved=True)
+        return Post.objects.filter(
+            created_user_id=self.kwargs["pk"], approved=True
+        ).with_user_votes(self.request.user)
+
+
+def collection_page_tags(request, pk, **kwargs):
+    return [POSTS_TAG, collection_tag(pk)]
+
+
+def collection_list_page_tags(request, pk=None, **kwargs):
+    return [user_collections_tag(request.user.pk if pk is None else pk)]
 
 
 class UserCollectionListView(View):
     template_name = "dshunt/user/user_collection_list.html"
     paginate_by = 25
-    context = dict()
 
+    @method_decorator(conditional_page(collection_list_page_tags))
     def get(self, request, **kwargs):
-        page = self.request.GET.get("page", 1)
         pk = self.kwargs["pk"]
-        c = Collection.objects.filter(created_user_id=pk)
-        paginator = Paginator(c, self.paginate_by)
-        page_obj = paginator.page(page)
-        self.context["paginator"] = paginator
-        self.context["page_obj"] = page_obj
-        return render(request, template_name=self.template_name, context=self.context)
+        c = Collection.objects.filter(created_user_id=pk).select_related("created_user")
+        paginator, page_obj = paginate_by_cursor(request, c, self.paginate_by, ["-id"])
+        context = {"paginator": paginator, "page_obj": page_obj}
+        return render(request, template_name=self.template_name, context=context)
 
 
 class UserCollectionDetailView(View):
+    @method_decorator(conditional_page(collection_page_tags))
     def get(self, request, *args, **kwargs):
         pk = kwargs["pk"]
-        page = request.GET.get("page", 1)
-        per_page = request.GET.get("per_page", 25)
         collection = get_object_or_404(Collection, pk=pk)
-        posts = collection.posts.select_related().order_by("-title")
+        posts = collection.ordered_posts().with_card_relations().with_user_votes(request.user)
 
-        paginator = Paginator(posts, per_page)
-        page_obj = paginator.page(page)
+        paginator, page_obj = paginate_by_cursor(request, posts, 25, ["position"])
 
         context = {
             "collection": collection,
@@ -123,7 +149,7 @@ class UserCollectionDetailView(View):
             "post_list": page_obj.object_list,
             "paginator": paginator,
             "page_obj": page_obj,
-            "posts_count": posts.count(),
+            "posts_count": fast_count(posts),
         }
         return render(
             request,
@@ -135,31 +161,29 @@ class UserCollectionDetailView(View):
 @method_decorator(login_required, name="dispatch")
 class PostListHomeView(View):
     model = Post
-
-    def update_post_context(self, posts):
-        for post in posts:
-            post.is_voted = post.is_voted(self.request.user)
+    days = 7
+    posts_per_day = 5
 
     def get(self, request, *args, **kwargs):
         object_list = []
 
-        today = datetime.date.today()
-
-        for i in range(7):
-            object_data = {}
-            post_date = today - datetime.timedelta(days=i)
-            posts = self.model.objects.filter(
-                published_at__date=post_date, approved=True
+        today = timezone.localdate()
+        posts = DailyRanking.objects.top_posts(
+            today - datetime.timedelta(days=self.days - 1),
+            today,
+            user=request.user,
+            per_day=self.posts_per_day,
+        )
+        for post_date, day_posts in groupby(posts, key=attrgetter("post_date")):
+            day_posts = list(day_posts)
+            object_list.append(
+                {
+                    "date": post_date,
+                    "post_count": day_posts[0].day_post_count,
+                    "post_list": day_posts,
+                }
             )
 
-            if posts.exists():
-                object_data["date"] = post_date
-                object_data["post_count"] = posts.count()
-                posts = posts.order_by("-total_votes")[:5]
-                self.update_post_context(posts)
-                object_data["post_list"] = posts
-                object_list.append(object_data)
-
         # Redirecting to all post list when main_posts is empty
         if not list(filter(None, object_list)):
             return redirect("posts")
@@ -171,39 +195,94 @@ class PostListHomeView(View):
         return render(request, "posts.html", context)
 
 
-class PostListByDateView(DayArchiveView):
-    queryset = Post.objects.filter(approved=True).order_by("-total_votes")
+class PostListByDateView(ConditionalGetMixin, DayArchiveView):
+    page_cache_params = ("page",)
+    queryset = Post.objects.filter(approved=True).order_by(
+        "daily_ranking__rank", "-total_votes"
+    )
     date_field = "published_at"
     template_name = "dshunt/post_list/post_list.html"
     paginate_by = 10
+    paginator_class = EstimatedCountPaginator
 
-    def update_post_context(self, posts):
-        for post in posts:
-            post.is_voted = post.is_voted(self.request.user)
-
-    def get_context_data(self, *, object_list=None, **kwargs):
-        context = super().get_context_data(**kwargs)
-        self.update_post_context(context["object_list"])
-        return context
+    def get_queryset(self):
+        return (
+            super()
+            .get_queryset()
+            .with_card_relations()
+            .with_user_votes(self.request.user)
+        )
 
 
-class PostListView(ListView):
+class PostListView(ConditionalGetMixin, CursorPaginationMixin, ListView):
     template_name = "dshunt/post_list/post_list.html"
     queryset = Post.objects.filter(approved=True).order_by("-published_at")
     paginate_by = 10
+    page_cache_params = ("cursor", "per_page", "sort", "tag", "match")
+    # ?sort= values and the PostQuerySet method ordering by each
+    sort_methods = {
+        "new": "sorted_by_newest",
+        "votes": "sorted_by_upvotes",
+        "trending": "sorted_by_trending",
+    }
+
+    def get_sorted_queryset(self, queryset):
+        method = self.sort_methods.get(self.request.GET.get("sort"))
+        return getattr(queryset, method)() if method else queryset
 
-    def update_post_context(self, posts):
-        for post in posts:
-            post.is_voted = post.is_voted(self.request.user)
+    def get_tags(self):
+        """Tags from `?tag=`, matched all together unless `?match=any`."""
+        return self.request.GET.getlist("tag")
+
+    def get_queryset(self):
+        return (
+            self.get_sorted_queryset(super().get_queryset())
+            .tagged(self.get_tags(), match_all=self.request.GET.get("match") != "any")
+            .with_card_relations()
+            .with_user_votes(self.request.user)
+        )
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["add_to_coll_form"] = CollectionListForm()
-        per_page = self.request.GET.get("per_page")
-        if per_page:
-            self.paginate_by = per_page
+        context["add_to_coll_form"] = CollectionListForm(user=self.request.user)
+        return context
+
 
-        self.update_post_context(context["object_list"])
+class TagPostListView(PostListView):
+    def get_tags(self):
+        return [self.kwargs["tag"], *super().get_tags()]
+
+    def get_context_data(self, *, object_list=None, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["tag"] = self.kwargs["tag"]
+        return context
+
+
+class PostSearchView(PostListView):
+    """Approved posts matching `?q=`, most relevant first."""
+
+    template_name = "dshunt/search.html"
+    queryset = Post.objects.filter(approved=True)
+    cursor_ordering = ["-rank", "-id"]
+    sort_methods = {}
+    # Free-text queries would rarely hit
+    page_cache_params = None
+
+    def get_queryset(self):
+        self.form = SearchForm(self.request.GET)
+        data = self.form.cleaned_data if self.form.is_valid() else {}
+        queryset = super().get_queryset().search(data.get("q", ""))
+        if not data.get("q", "").strip():
+            return queryset.none()
+        if data["post_type"]:
+            queryset = queryset.filter(post_type=data["post_type"])
+        if data["category"]:
+            queryset = queryset.filter(category=data["category"])
+        return queryset
+
+    def get_context_data(self, *, object_list=None, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["search_form"] = self.form
         return context
 
 
@@ -337,26 +416,38 @@ class PodcastEpisodeCreateView(VideoCreateView):
     post_type = PostType.PODCAST
 
 
-class PostDetailView(DetailView):
-    queryset = Post.objects.filter(approved=True)
+class PostDetailView(ConditionalGetMixin, DetailView):
+    queryset = Post.objects.filter(approved=True).with_card_relations()
     template_name = "dshunt/post_detail/post_detail.html"
+    page_cache_params = ("cursor",)
 
-    def get_comments(self, post):
-        return post.postcomment_set.order_by("-id")
+    def get_page_cache_tags(self):
+        return [REFERENCES_TAG, post_tag(self.kwargs["pk"])]
+
+    comments_per_page = 5
 
-    def get_comment_set(self, post_comments):
-        if self.request.GET.get("comment") is None:
-            post_comments = post_comments[:5]
-        for comment in post_comments:
-            comment.is_commented = comment.is_commented(self.request.user)
-        return post_comments
+    def get_comments(self, post):
+        """Cursor page of `post`'s comments, newest first."""
+        comments = (
+            PostComment.objects.filter(post=post)
+            .select_related("created_user")
+            .with_user_ownership(self.request.user)
+        )
+        paginator, page = paginate_by_cursor(
+            self.request,
+            comments,
+            self.comments_per_page,
+            ordering=["-id"],
+            per_page_param=None,
+        )
+        return page
 
     def get_context_data(self, **kwargs):
-        post_comments = self.get_comments(self.object)
         context = super().get_context_data(**kwargs)
-        context["comments"] = self.get_comment_set(post_comments)
+        context["comments"] = self.get_comments(self.object)
         context["comment_form"] = CommentForm()
-        context["comments_count"] = post_comments.count()
+        context["comments_count"] = self.object.comment_count
+        context["related_posts"] = RelatedPost.objects.for_post(self.object)
 
         return context
 
@@ -381,29 +472,37 @@ class CommentCreateView(CreateView):
         return redirect("post-detail", pk=self.kwargs.get("pk"))
 
 
+@method_decorator(login_required, name="dispatch")
 class Vote(View):
-    def get(self, request, *args, **kwargs):
+    # POST only, with a CSRF token: link prefetchers and other sites must not cast votes
+    def post(self, request, *args, **kwargs):
         post_id = kwargs["id"]
         post = get_object_or_404(Post, pk=post_id)
+        PostVote.objects.cast(post, request.user)
+        return redirect("posts")
 
-        with transaction.atomic():
-            vote, created = PostVote.objects.get_or_create(
-                post=post, created_user=request.user
-            )
-            if created:
-                post.total_votes += 1
-                post.save()
-                vote.save()
 
+@method_decorator(login_required, name="dispatch")
+class Unvote(View):
+    # POST only, with a CSRF token, like Vote
+    def post(self, request, *args, **kwargs):
+        post_id = kwargs["id"]
+        post = get_object_or_404(Post, pk=post_id)
+        PostVote.objects.retract(post, request.user)
         return redirect("posts")
 
 
 def category(request):
-    categories = Category.objects.all()
+    categories = reference_table(Category).all()
     context = {"categories": categories}
     return render(request, "dshunt/category.html", context)
 
 
+def tag_list(request):
+    context = {"tags": TagCount.objects.cloud()}
+    return render(request, "dshunt/tag_list.html", context)
+
+
 # Collections
 
 
@@ -414,11 +513,9 @@ def collection_create_view(request):
     if request.method == "POST":
         form = CollectionForm(request.POST)
         if form.is_valid():
-            posts = form.cleaned_data.get("posts")
             form.instance.created_user = request.user
+            # save_m2m writes the selected posts in one INSERT
             form.save()
-            for post in posts:
-                form.instance.posts.add(post)
             return redirect("collection-list")
         else:
             return render(
@@ -428,14 +525,14 @@ def collection_create_view(request):
 
 
 @login_required
+@conditional_page(collection_list_page_tags)
 def collection_list_view(request):
-    per_page = request.GET.get("per_page", 10)
-    page = request.GET.get("page", 1)
     is_paginated = True
 
-    collections = Collection.objects.filter(created_user=request.user)
-    paginator = Paginator(collections, int(per_page))
-    page_obj = paginator.page(int(page))
+    collections = Collection.objects.filter(created_user=request.user).select_related(
+        "created_user"
+    )
+    paginator, page_obj = paginate_by_cursor(request, collections, 10, ["-id"])
     context = dict()
     # object_list = page_obj.object_list
     # context['object_list'] = object_list
@@ -447,14 +544,12 @@ def collection_list_view(request):
 
 
 @login_required
+@conditional_page(collection_page_tags)
 def collection_detail_view(request, pk):
-    page = request.GET.get("page", 1)
-    per_page = request.GET.get("per_page", 25)
     collection = get_object_or_404(Collection, pk=pk)
-    posts = collection.posts.select_related().order_by("-title")
+    posts = collection.ordered_posts().with_card_relations().with_user_votes(request.user)
 
-    paginator = Paginator(posts, per_page)
-    page_obj = paginator.page(page)
+    paginator, page_obj = paginate_by_cursor(request, posts, 25, ["position"])
 
     context = {
         "collection": collection,
@@ -462,7 +557,7 @@ def collection_detail_view(request, pk):
         "post_list": page_obj.object_list,
         "paginator": paginator,
         "page_obj": page_obj,
-        "posts_count": posts.count(),
+        "posts_count": fast_count(posts),
     }
     return render(
         request,
@@ -479,41 +574,87 @@ def add_post_to_collection_view(request, pk):
         model_name = request.GET.get("model")
         if model_name == "collection":
             form = AddtoCollectionForm(request.POST)
-            coll_obj = Collection.objects.get(id=pk)
-            post = request.POST["post"]
             col_id = pk
         elif model_name == "post":
-            form = AddtoCollectionForm(request.POST)
-            coll_obj = request.POST["collection"]
-            post = Post.objects.get(pk=pk)
-            col_id = coll_obj
+            form = CollectionListForm(request.POST, user=request.user)
+            col_id = None
         else:
             return HttpResponseNotFound("Get request not found")
 
         if form.is_valid():
-            coll_obj.posts.add(post)
+            if model_name == "collection":
+                post_ids = [form.cleaned_data["post"].pk]
+            else:
+                col_id, post_ids = form.cleaned_data["collection"].pk, [pk]
+            collection = get_object_or_404(Collection, pk=col_id, created_user=request.user)
+            collection.add_posts(post_ids)
             return redirect("collection-detail", pk=col_id)
-        else:
+        elif col_id is not None:
             return redirect("collection-detail", pk=col_id)
+        else:
+            return redirect("posts")
     else:
         return redirect("root")
 
 
+@login_required
+@require_POST
+def collection_posts_view(request, pk):
+    """Add, remove or move many posts of one of the user's collections at once."""
+    collection = get_object_or_404(Collection, pk=pk, created_user=request.user)
+    form = CollectionPostsForm(request.POST)
+    if not form.is_valid():
+        return JsonResponse({"errors": form.errors}, status=400)
+
+    post_ids = form.cleaned_data["posts"]
+    if form.cleaned_data["action"] == "add":
+        changed = collection.add_posts(post_ids)
+    elif form.cleaned_data["action"] == "move":
+        changed = collection.move_posts(post_ids, after=form.cleaned_data["after"])
+    else:
+        changed = collection.remove_posts(post_ids)
+    return JsonResponse(
+        {"action": form.cleaned_data["action"], "requested": len(post_ids), "changed": changed}
+    )
+
+
+# Autocomplete
+
+AUTOCOMPLETE_RESULTS = 20
+
+
+def autocomplete_response(queryset):
+    """The first AUTOCOMPLETE_RESULTS of `queryset` as {"results": [{id, text}]}."""
+    rows = queryset.values_list("pk", "title")[:AUTOCOMPLETE_RESULTS]
+    return JsonResponse({"results": [{"id": pk, "text": title} for pk, title in rows]})
+
+
+def post_autocomplete_view(request):
+    q = request.GET.get("q", "").strip()
+    if not q:
+        return JsonResponse({"results": []})
+    return autocomplete_response(title_prefix(Post.objects.filter(approved=True), q))
+
+
+@login_required
+def collection_autocomplete_view(request):
+    q = request.GET.get("q", "").strip()
+    collections = Collection.objects.filter(created_user=request.user)
+    return autocomplete_response(title_prefix(collections, q))
+
+
 # Staff Picks
 
 
 @login_required
 def staff_pick_collection_list(request):
-    per_page = request.GET.get("per_page", 10)
-    page = request.GET.get("page", 1)
     is_paginated = True
 
     collections = Collection.objects.filter(
         is_staffpick=True, created_user=request.user
-    )
+    ).select_related("created_user")
 
-    paginator = Paginator(collections, int(per_page))
-    page_obj = paginator.page(int(page))
+    paginator, page_obj = paginate_by_cursor(request, collections, 10, ["-id"])
     context = dict()
     # object_list = page_obj.object_list
     # context['object_list'] = object_list
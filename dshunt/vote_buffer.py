@@ -0,0 +1,288 @@
+"""
+Write-behind buffering of Post.total_votes increments.
+
+Votes themselves are written immediately; only the counter updates are
+collected here and applied in batches, either when `MAX_PENDING` entries are
+waiting or when the oldest pending delta is `MAX_DELAY` seconds old.
+Enable it with the VOTE_BUFFER setting, e.g.
+
+    VOTE_BUFFER = {
+        "BACKEND": "dshunt.vote_buffer.MemoryVoteBuffer",
+        "MAX_PENDING": 500,
+        "MAX_DELAY": 5,
+        "STATS_INTERVAL": 60,
+    }
+
+Every process using the buffer logs its stats, pending and flushed deltas,
+to the "dshunt.vote_buffer" logger at most every `STATS_INTERVAL` seconds.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, connections, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import DailyRanking, Post
+from .page_cache import POSTS_TAG, expire_pages, post_tag
+
+logger = logging.getLogger(__name__)
+
+FLUSH_BATCH_SIZE = 1000
+
+
+def apply_deltas(deltas):
+    """
+    Add {post_id: delta} to the posts' total_votes, re-rank their days and
+    expire their cached pages.
+    """
+    days, post_ids = set(), []
+    items = list(deltas.items())
+    with transaction.atomic(), connection.cursor() as cursor:
+        for start in range(0, len(items), FLUSH_BATCH_SIZE):
+            batch = items[start:start + FLUSH_BATCH_SIZE]
+            cursor.execute(
+                """
+                UPDATE {table} p SET total_votes = p.total_votes + v.delta
+                FROM (VALUES {values}) AS v (id, delta)
+                WHERE p.id = v.id
+                RETURNING p.id, p.approved, p.published_at
+                """.format(
+                    table=Post._meta.db_table,
+                    values=", ".join(["(%s::bigint, %s::integer)"] * len(batch)),
+                ),
+                [value for item in batch for value in item],
+            )
+            for post_id, approved, published_at in cursor.fetchall():
+                post_ids.append(post_id)
+                if approved and published_at:
+                    days.add(timezone.localdate(published_at))
+        expire_pages([POSTS_TAG] + [post_tag(post_id) for post_id in post_ids])
+    for day in days:
+        DailyRanking.objects.refresh_day(day)
+
+
+class BaseVoteBuffer:
+    # Whether every process sees the same buffer, so another one can flush
+    # it or report on it
+    shared = False
+
+    def __init__(self, max_pending=500, max_delay=5, stats_interval=60):
+        self.max_pending = max_pending
+        self.max_delay = max_delay
+        self.stats_interval = stats_interval
+        self.flushed_batches = 0
+        self.flushed_delta = 0
+        self._stats_logged_at = time.monotonic()
+
+    def add(self, post_id, delta):
+        self.push(post_id, delta)
+        oldest_age = self.oldest_age()
+        if self.pending_count() >= self.max_pending or (
+            oldest_age is not None and oldest_age >= self.max_delay
+        ):
+            self.flush()
+        if time.monotonic() - self._stats_logged_at >= self.stats_interval:
+            self.log_stats()
+
+    def flush(self):
+        deltas = {post_id: delta for post_id, delta in self.drain().items() if delta}
+        if not deltas:
+            return deltas
+        try:
+            apply_deltas(deltas)
+        except Exception:
+            for post_id, delta in deltas.items():
+                self.push(post_id, delta)
+            raise
+        self.flushed_batches += 1
+        self.flushed_delta += sum(deltas.values())
+        logger.info(
+            "Flushed %s buffered votes over %s posts", sum(deltas.values()), len(deltas)
+        )
+        return deltas
+
+    def log_stats(self):
+        self._stats_logged_at = time.monotonic()
+        logger.info(
+            "Vote buffer %s",
+            " ".join("{}={}".format(name, value) for name, value in self.stats().items()),
+        )
+
+    def stats(self):
+        pending = self.pending()
+        return {
+            "pending_posts": len(pending),
+            "pending_delta": sum(pending.values()),
+            "oldest_age": self.oldest_age(),
+            "flushed_batches": self.flushed_batches,
+            "flushed_delta": self.flushed_delta,
+        }
+
+    def push(self, post_id, delta):
+        raise NotImplementedError
+
+    def drain(self):
+        """Remove and return every pending delta as {post_id: delta}."""
+        raise NotImplementedError
+
+    def pending(self):
+        raise NotImplementedError
+
+    def pending_count(self):
+        """Cheap size of the buffer, compared against MAX_PENDING."""
+        raise NotImplementedError
+
+    def oldest_age(self):
+        """Seconds since the oldest pending delta was added, None when empty."""
+        raise NotImplementedError
+
+
+class MemoryVoteBuffer(BaseVoteBuffer):
+    """Per-process buffer, flushed by a timer thread within MAX_DELAY."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._lock = threading.Lock()
+        self._deltas = {}
+        self._since = None
+        atexit.register(self.flush)
+
+    def push(self, post_id, delta):
+        with self._lock:
+            self._deltas[post_id] = self._deltas.get(post_id, 0) + delta
+            if self._since is None:
+                self._since = time.monotonic()
+                timer = threading.Timer(self.max_delay, self._flush_in_background)
+                timer.daemon = True
+                timer.start()
+
+    def drain(self):
+        with self._lock:
+            deltas, self._deltas, self._since = self._deltas, {}, None
+        return deltas
+
+    def pending(self):
+        with self._lock:
+            return dict(self._deltas)
+
+    def pending_count(self):
+        return len(self._deltas)
+
+    def oldest_age(self):
+        since = self._since
+        return None if since is None else time.monotonic() - since
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Flushing buffered votes failed")
+        finally:
+            connections.close_all()
+
+
+class CacheVoteBuffer(BaseVoteBuffer):
+    """
+    Buffer shared by every worker through the default cache.
+
+    Deltas are appended to a log of numbered slots so concurrent writers
+    never overwrite each other; point CACHES at Redis or Memcached to share
+    it between processes. Run `manage.py flush_vote_buffer` on a schedule
+    to honour MAX_DELAY when traffic is idle.
+    """
+
+    key_prefix = "dshunt:vote-buffer"
+    shared = True
+
+    def key(self, name):
+        return "{}:{}".format(self.key_prefix, name)
+
+    def push(self, post_id, delta):
+        cache.add(self.key("seq"), 0, None)
+        slot = cache.incr(self.key("seq"))
+        cache.set(self.key("slot:{}".format(slot)), (post_id, delta), None)
+        cache.add(self.key("since"), time.time(), None)
+
+    def _slots(self):
+        cursor = cache.get(self.key("cursor"), 0)
+        seq = cache.get(self.key("seq"), 0)
+        keys = [self.key("slot:{}".format(slot)) for slot in range(cursor + 1, seq + 1)]
+        values = cache.get_many(keys)
+        slots = []
+        for slot, key in enumerate(keys, start=cursor + 1):
+            # A missing slot is still being written; stop there unless it is
+            # older than the staleness bound, in which case it was lost.
+            if key not in values and not self._is_lost(slot):
+                break
+            slots.append((slot, key, values.get(key)))
+        return slots
+
+    def _is_lost(self, slot):
+        stalled = cache.get(self.key("stalled"))
+        if stalled and stalled[0] == slot:
+            return time.time() - stalled[1] >= self.max_delay
+        cache.set(self.key("stalled"), (slot, time.time()), None)
+        return False
+
+    def drain(self):
+        if not cache.add(self.key("lock"), 1, 60):
+            return {}
+        try:
+            slots = self._slots()
+            deltas = {}
+            for slot, key, value in slots:
+                if value is not None:
+                    post_id, delta = value
+                    deltas[post_id] = deltas.get(post_id, 0) + delta
+            if slots:
+                cache.set(self.key("cursor"), slots[-1][0], None)
+                cache.delete_many([key for slot, key, value in slots])
+                if cache.get(self.key("seq"), 0) > slots[-1][0]:
+                    cache.set(self.key("since"), time.time(), None)
+                else:
+                    cache.delete(self.key("since"))
+            return deltas
+        finally:
+            cache.delete(self.key("lock"))
+
+    def pending(self):
+        deltas = {}
+        for slot, key, value in self._slots():
+            if value is not None:
+                deltas[value[0]] = deltas.get(value[0], 0) + value[1]
+        return deltas
+
+    def pending_count(self):
+        return cache.get(self.key("seq"), 0) - cache.get(self.key("cursor"), 0)
+
+    def oldest_age(self):
+        since = cache.get(self.key("since"))
+        return None if since is None else time.time() - since
+
+
+_buffer = None
+_buffer_config = None
+_buffer_lock = threading.Lock()
+
+
+def get_vote_buffer():
+    """The configured vote buffer, or None when votes are applied immediately."""
+    global _buffer, _buffer_config
+    config = getattr(settings, "VOTE_BUFFER", None)
+    if not config:
+        return None
+    with _buffer_lock:
+        if _buffer is None or _buffer_config != config:
+            buffer_class = import_string(config["BACKEND"])
+            _buffer = buffer_class(
+                max_pending=config.get("MAX_PENDING", 500),
+                max_delay=config.get("MAX_DELAY", 5),
+                stats_interval=config.get("STATS_INTERVAL", 60),
+            )
+            _buffer_config = config
+    return _buffer
@@ -0,0 +1,43 @@
+// Turns each <select data-autocomplete-url> into a search box whose options
+// are fetched as the user types, see AutocompleteSelect in dshunt/forms.py.
+(function () {
+  function attach(select) {
+    const input = document.createElement('input');
+    input.type = 'search';
+    input.className = 'form-control mb-1';
+    input.placeholder = 'Type to search';
+    input.autocomplete = 'off';
+    select.parentNode.insertBefore(input, select);
+
+    let timer = null;
+    let request = 0;
+    input.addEventListener('input', function () {
+      clearTimeout(timer);
+      timer = setTimeout(function () {
+        const current = ++request;
+        const url = select.dataset.autocompleteUrl + '?q=' + encodeURIComponent(input.value);
+        fetch(url, {credentials: 'same-origin'})
+          .then(function (response) { return response.json(); })
+          .then(function (data) {
+            // A slower, older response must not replace a newer one
+            if (current !== request) {
+              return;
+            }
+            // A multiple select keeps the choices made from earlier searches
+            const kept = select.multiple ? Array.from(select.selectedOptions) : [];
+            select.innerHTML = '';
+            kept.forEach(function (option) { select.add(option); });
+            data.results.forEach(function (result) {
+              if (!kept.some(function (option) { return option.value === String(result.id); })) {
+                select.add(new Option(result.text, result.id));
+              }
+            });
+          });
+      }, 250);
+    });
+  }
+
+  document.addEventListener('DOMContentLoaded', function () {
+    document.querySelectorAll('select[data-autocomplete-url]').forEach(attach);
+  });
+})();